@@ -0,0 +1,29 @@
+"""Add appointment search indexes
+
+Revision ID: 3b2f4c9e7a1d
+Revises: 085e65b8c7f1
+Create Date: 2022-08-02 18:41:07.512314
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b2f4c9e7a1d'
+down_revision = '085e65b8c7f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('appointments_date_idx', 'appointments', ['date'])
+    op.create_index('appointments_client_id_date_idx', 'appointments', ['client_id', 'date'])
+    op.create_index('appointments_unpaid_date_idx', 'appointments', ['date'],
+                    postgresql_where=sa.text('NOT paid'))
+
+
+def downgrade() -> None:
+    op.drop_index('appointments_unpaid_date_idx', table_name='appointments')
+    op.drop_index('appointments_client_id_date_idx', table_name='appointments')
+    op.drop_index('appointments_date_idx', table_name='appointments')
@@ -0,0 +1,30 @@
+"""Request intake
+
+Revision ID: 4d6c1e8a2f57
+Revises: 9e4a7d2b61f3
+Create Date: 2022-08-16 11:03:52.204718
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d6c1e8a2f57'
+down_revision = '9e4a7d2b61f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The model always called it date_made
+    op.alter_column('requests', 'date_joined', new_column_name='date_made')
+    # The same person may ask for several quotes
+    op.drop_constraint('requests_email_key', 'requests', type_='unique')
+    op.create_index('requests_date_made_idx', 'requests', ['date_made', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('requests_date_made_idx', table_name='requests')
+    op.create_unique_constraint('requests_email_key', 'requests', ['email'])
+    op.alter_column('requests', 'date_made', new_column_name='date_joined')
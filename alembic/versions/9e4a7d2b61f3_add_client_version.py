@@ -0,0 +1,64 @@
+"""Add client version
+
+Revision ID: 9e4a7d2b61f3
+Revises: c5d81a6f0e42
+Create Date: 2022-08-09 16:27:45.881062
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4a7d2b61f3'
+down_revision = 'c5d81a6f0e42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('clients', sa.Column('version', sa.Integer(),
+                                       nullable=False, server_default=sa.text('0')))
+    op.execute("""
+        CREATE OR REPLACE FUNCTION bump_client_version() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE clients SET version = version + 1
+                WHERE id IN (SELECT client_id FROM new_rows);
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE clients SET version = version + 1
+                WHERE id IN (SELECT client_id FROM old_rows);
+            ELSE
+                UPDATE clients SET version = version + 1
+                WHERE id IN (
+                    SELECT client_id FROM new_rows
+                    UNION SELECT client_id FROM old_rows
+                );
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER appointments_bump_client_version_insert
+        AFTER INSERT ON appointments REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_client_version()
+    """)
+    op.execute("""
+        CREATE TRIGGER appointments_bump_client_version_update
+        AFTER UPDATE ON appointments
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_client_version()
+    """)
+    op.execute("""
+        CREATE TRIGGER appointments_bump_client_version_delete
+        AFTER DELETE ON appointments REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_client_version()
+    """)
+
+
+def downgrade() -> None:
+    for event in ('delete', 'update', 'insert'):
+        op.execute(f'DROP TRIGGER appointments_bump_client_version_{event} ON appointments')
+    op.execute('DROP FUNCTION bump_client_version()')
+    op.drop_column('clients', 'version')
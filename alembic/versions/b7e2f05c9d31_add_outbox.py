@@ -0,0 +1,46 @@
+"""Add outbox
+
+Revision ID: b7e2f05c9d31
+Revises: 4d6c1e8a2f57
+Create Date: 2022-08-23 14:12:09.517830
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2f05c9d31'
+down_revision = '4d6c1e8a2f57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'outbox',
+        sa.Column('id',              sa.Integer(),
+                  nullable=False, primary_key=True),
+        sa.Column('created_at',      sa.sql.sqltypes.TIMESTAMP(timezone=True),
+                  nullable=False, server_default=sa.sql.expression.text('now()')),
+        sa.Column('kind',            sa.String(),
+                  nullable=False),
+        sa.Column('recipient',       sa.String(),
+                  nullable=False),
+        sa.Column('payload',         postgresql.JSONB(),
+                  nullable=False, server_default=sa.sql.expression.text("'{}'")),
+        sa.Column('attempts',        sa.Integer(),
+                  nullable=False, server_default=sa.sql.expression.text('0')),
+        sa.Column('next_attempt_at', sa.sql.sqltypes.TIMESTAMP(timezone=True),
+                  nullable=False, server_default=sa.sql.expression.text('now()')),
+        sa.Column('sent_at',         sa.sql.sqltypes.TIMESTAMP(timezone=True)),
+        sa.Column('last_error',      sa.String())
+        )
+    op.create_index('outbox_pending_idx', 'outbox', ['next_attempt_at'],
+                    postgresql_where=sa.text('sent_at IS NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('outbox_pending_idx', table_name='outbox')
+    op.drop_table('outbox')
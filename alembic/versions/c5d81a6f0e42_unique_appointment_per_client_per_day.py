@@ -0,0 +1,37 @@
+"""Unique appointment per client per day
+
+Revision ID: c5d81a6f0e42
+Revises: 3b2f4c9e7a1d
+Create Date: 2022-08-04 10:12:53.204719
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d81a6f0e42'
+down_revision = '3b2f4c9e7a1d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Bookings could race before the constraint; the earliest of a client's
+    # appointments on a day is kept
+    op.execute("""
+        DELETE FROM appointments AS duplicate
+        USING appointments AS kept
+        WHERE duplicate.client_id = kept.client_id
+            AND duplicate.date = kept.date
+            AND duplicate.id > kept.id
+    """)
+    # The constraint's index covers (client_id, date) lookups on its own
+    op.create_unique_constraint('appointments_client_id_date_key', 'appointments',
+                                ['client_id', 'date'])
+    op.drop_index('appointments_client_id_date_idx', table_name='appointments')
+
+
+def downgrade() -> None:
+    op.create_index('appointments_client_id_date_idx', 'appointments', ['client_id', 'date'])
+    op.drop_constraint('appointments_client_id_date_key', 'appointments', type_='unique')
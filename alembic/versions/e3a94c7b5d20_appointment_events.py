@@ -0,0 +1,60 @@
+"""Appointment events
+
+Revision ID: e3a94c7b5d20
+Revises: b7e2f05c9d31
+Create Date: 2022-08-25 10:41:37.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a94c7b5d20'
+down_revision = 'b7e2f05c9d31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_appointment_changed() RETURNS trigger AS $$
+        DECLARE
+            appointment appointments;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                appointment := OLD;
+            ELSE
+                appointment := NEW;
+            END IF;
+            PERFORM pg_notify('appointment_changed', json_build_object(
+                'event', CASE TG_OP
+                    WHEN 'INSERT' THEN 'created'
+                    WHEN 'DELETE' THEN 'cancelled'
+                    ELSE 'paid' END,
+                'id', appointment.id,
+                'client_id', appointment.client_id,
+                'date', appointment.date,
+                'paid', appointment.paid
+            )::text);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER appointments_notify_changed
+        AFTER INSERT OR DELETE ON appointments
+        FOR EACH ROW EXECUTE FUNCTION notify_appointment_changed()
+    """)
+    op.execute("""
+        CREATE TRIGGER appointments_notify_paid
+        AFTER UPDATE OF paid ON appointments
+        FOR EACH ROW WHEN (OLD.paid IS DISTINCT FROM NEW.paid)
+        EXECUTE FUNCTION notify_appointment_changed()
+    """)
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER appointments_notify_paid ON appointments')
+    op.execute('DROP TRIGGER appointments_notify_changed ON appointments')
+    op.execute('DROP FUNCTION notify_appointment_changed()')
@@ -1,9 +1,16 @@
 from fastapi import FastAPI, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from .routers import client, appointment, auth
+from fastapi.responses import PlainTextResponse
+from . import events, intake, metrics, notify, oauth2, ratelimit
+from .cache import response_cache
+from .config import settings
+from .database import pool_metrics
+from .responses import ORJSONResponse
+from .routers import client, appointment, auth, debug, export, request
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
+app.add_middleware(ratelimit.RateLimitMiddleware, limiter=ratelimit.limiter)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -11,10 +18,43 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(
+    metrics.TimingMiddleware,
+    repeated_query_threshold=settings.repeated_query_threshold,
+    query_header=settings.environment != "production",
+)
 
 app.include_router(client.router)
 app.include_router(appointment.router)
 app.include_router(auth.router)
+app.include_router(debug.router)
+app.include_router(export.router)
+app.include_router(request.router)
+
+
+@app.on_event("startup")
+def start_listener():
+    if settings.client_cache_notify:
+        notify.listener.subscribe(notify.CLIENT_CHANGED, oauth2.on_client_changed)
+    if settings.appointment_events:
+        notify.listener.subscribe(notify.APPOINTMENT_CHANGED, events.broker.publish)
+    if notify.listener.callbacks:
+        notify.listener.start()
+
+
+@app.on_event("shutdown")
+def stop_listener():
+    notify.listener.stop()
+
+
+@app.on_event("startup")
+def start_request_buffer():
+    intake.buffer.start()
+
+
+@app.on_event("shutdown")
+async def flush_request_buffer():
+    await intake.buffer.stop()
 
 
 @app.get("/")
@@ -22,6 +62,24 @@ def root():
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def get_metrics():
+    """
+    Request, connection pool and cache statistics in the Prometheus text format
+    """
+    return metrics.render_prometheus(
+        metrics.request_metrics,
+        pool_metrics,
+        {
+            "token": oauth2.token_cache,
+            "claims": oauth2.claims_cache,
+            "client": oauth2.client_cache,
+            "response": response_cache,
+        },
+        ratelimit.limiter.rejected,
+    )
+
+
 @app.get("/test", status_code=status.HTTP_200_OK)
 def test():
     return {"message": "Hello, World!"}
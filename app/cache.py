@@ -0,0 +1,234 @@
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from time import time
+from typing import Any, Hashable, Optional, Tuple
+import orjson
+from .config import settings
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries also expire at an absolute timestamp.
+    Safe to share between the threadpool workers serving sync endpoints.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time():
+                del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, expires_at: Optional[float] = None):
+        if self.ttl is not None:
+            ttl_expiry = time() + self.ttl
+            expires_at = (
+                ttl_expiry if expires_at is None else min(expires_at, ttl_expiry)
+            )
+        if self.maxsize <= 0 or (expires_at is not None and expires_at <= time()):
+            return
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class MemoryBackend:
+    """
+    Per-process LRU store of byte strings, capped by their total size
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = Lock()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        if len(value) > self.max_bytes:
+            return
+        expires_at = None if ttl is None else time() + ttl
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, expires_at)
+            self.bytes += len(value)
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[0])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "size": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class RedisBackend:
+    """
+    Store shared by every worker, on any client with the redis.asyncio API
+    (get, set with ex). Entries expire through Redis.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisBackend":
+        try:
+            from redis import asyncio as redis
+        except ImportError as error:
+            raise RuntimeError(
+                "RESPONSE_CACHE_BACKEND=redis requires the redis package"
+            ) from error
+        return cls(redis.from_url(url))
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        await self.client.set(key, value, ex=None if ttl is None else int(ttl) or 1)
+
+    def clear(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": "redis"}
+
+
+CachedResponse = namedtuple("CachedResponse", ("body", "headers"))
+
+
+class ResponseCache:
+    """
+    Read-through cache of rendered responses, grouped by client. Entries are
+    stored under the client's version, which the database bumps with every
+    write to the client or its appointments, so once a write commits, in
+    any process, the responses computed before it are never served again.
+    """
+
+    def __init__(self, backend=None, ttl: Optional[float] = None):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get(
+        self, scope: Hashable, version: int, *key
+    ) -> Tuple[Optional[CachedResponse], str]:
+        """
+        Returns the cached response, if any, and the slot to store it under
+        """
+        if self.backend is None:
+            return None, None
+        slot = "response:{}:{}:{}".format(
+            scope, version, ":".join(str(part) for part in key)
+        )
+        value = await self.backend.get(slot)
+        if value is None:
+            self.misses += 1
+            return None, slot
+        self.hits += 1
+        headers, body = value.split(b"\n", 1)
+        return CachedResponse(body, orjson.loads(headers)), slot
+
+    async def set(self, slot: Optional[str], body: bytes, headers: dict):
+        if self.backend is None or slot is None:
+            return
+        await self.backend.set(slot, orjson.dumps(headers) + b"\n" + body, self.ttl)
+
+    def clear(self):
+        self.hits = self.misses = 0
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        stats = {
+            "enabled": self.backend is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+        if self.backend is not None:
+            stats.update(self.backend.stats())
+        return stats
+
+
+def make_response_cache() -> ResponseCache:
+    backend = settings.response_cache_backend
+    if backend == "memory":
+        return ResponseCache(
+            MemoryBackend(settings.response_cache_max_bytes),
+            settings.response_cache_ttl_seconds,
+        )
+    if backend == "redis":
+        return ResponseCache(
+            RedisBackend.from_url(settings.response_cache_url),
+            settings.response_cache_ttl_seconds,
+        )
+    return ResponseCache()
+
+
+response_cache = make_response_cache()
@@ -1,3 +1,4 @@
+from typing import Dict, List
 from pydantic import BaseSettings
 
 
@@ -8,10 +9,94 @@ class Settings(BaseSettings):
     database_port: str
     database_name: str
     database_driver: str
+    database_async: bool = False
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    database_pool_timeout: float = 30
+    database_pool_recycle: int = 1800
+    database_pool_pre_ping: bool = True
+    # JSON list of SQLAlchemy URLs; GET handlers read from these when set
+    database_replica_urls: List[str] = []
+    database_replica_sticky_seconds: float = 5
 
+    # The HMAC secret for HS256/384/512, or the PEM private key for RS256,
+    # ES256 and EdDSA
     token_secret: str
     token_algorithm: str
     token_expire_seconds: int
+    # "native" or "jose" (python-jose, no EdDSA)
+    token_backend: str = "native"
+    # Written to the kid header of new tokens
+    token_key_id: str = ""
+    # JSON object of kid: secret or PEM key still accepted, such as the keys
+    # rotated out while their tokens expire
+    token_verification_keys: Dict[str, str] = {}
+    token_cache_size: int = 4096
+
+    client_cache_size: int = 10000
+    client_cache_ttl_seconds: float = 60
+    client_cache_notify: bool = False
+
+    # "memory" (per worker), "redis" (shared between workers) or "none"
+    response_cache_backend: str = "memory"
+    response_cache_url: str = "redis://localhost:6379/0"
+    response_cache_max_bytes: int = 64 * 1024 * 1024
+    response_cache_ttl_seconds: float = 30
+
+    # "memory" (per worker), "redis" (shared between workers) or "none"
+    rate_limit_backend: str = "memory"
+    rate_limit_url: str = "redis://localhost:6379/0"
+    # Logins are budgeted per address, other requests per client when they
+    # carry a valid token and per address otherwise
+    rate_limit_login_per_minute: float = 10
+    rate_limit_login_burst: int = 10
+    rate_limit_read_per_minute: float = 600
+    rate_limit_read_burst: int = 120
+    rate_limit_write_per_minute: float = 120
+    rate_limit_write_burst: int = 60
+    # Proxies in front of the app that append to X-Forwarded-For (1 behind
+    # Heroku's router); their last entries are the client's address, anything
+    # left of those was sent by the client
+    rate_limit_proxy_hops: int = 0
+
+    bcrypt_rounds: int = 12
+    hashing_workers: int = 4
+    hashing_queue_depth: int = 64
+
+    appointment_page_size: int = 100
+    appointment_page_size_max: int = 1000
+    stream_batch_size: int = 500
+    appointment_bulk_size_max: int = 500
+
+    # Streams appointment changes from LISTEN/NOTIFY at /appointment/events
+    appointment_events: bool = True
+    appointment_events_queue_size: int = 100
+    appointment_events_heartbeat_seconds: float = 15
+    appointment_events_max_seconds: float = 300
+
+    request_batch_size: int = 500
+    request_flush_ms: int = 200
+    request_buffer_max: int = 10000
+
+    smtp_host: str = "localhost"
+    smtp_port: int = 25
+    smtp_username: str = ""
+    smtp_password: str = ""
+    smtp_starttls: bool = False
+    smtp_timeout: float = 10
+    smtp_sender: str = "no-reply@localhost"
+    outbox_batch_size: int = 100
+    outbox_poll_seconds: float = 1
+    outbox_max_attempts: int = 8
+    # Doubled after every failed attempt
+    outbox_backoff_seconds: float = 30
+    # How long a worker holds the rows it claimed before others may take them
+    outbox_lease_seconds: float = 600
+
+    # Anything but "production" adds debugging aids such as X-DB-Queries
+    environment: str = "production"
+    slow_query_seconds: float = 0.25
+    repeated_query_threshold: int = 5
 
     admin_username: str
     admin_password: str
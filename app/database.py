@@ -1,20 +1,186 @@
+from contextlib import asynccontextmanager
+from itertools import cycle
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from .cache import TTLCache
 from .config import settings
+from .metrics import (
+    InstrumentedAsyncQueuePool,
+    InstrumentedQueuePool,
+    PoolMetrics,
+    time_queries,
+)
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.database_username}:{settings.database_password}@{settings.database_address}:{settings.database_port}/{settings.database_name}"
+SQLALCHEMY_ASYNC_DATABASE_URL = f"postgresql+asyncpg://{settings.database_username}:{settings.database_password}@{settings.database_address}:{settings.database_port}/{settings.database_name}"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+POOL_OPTIONS = {
+    "pool_size": settings.database_pool_size,
+    "max_overflow": settings.database_max_overflow,
+    "pool_timeout": settings.database_pool_timeout,
+    "pool_recycle": settings.database_pool_recycle,
+    "pool_pre_ping": settings.database_pool_pre_ping,
+}
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedQueuePool, **POOL_OPTIONS
+)
+pool_metrics = {"primary": PoolMetrics(engine)}
+time_queries(engine, settings.slow_query_seconds)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+if settings.database_async:
+    async_engine = create_async_engine(
+        SQLALCHEMY_ASYNC_DATABASE_URL,
+        poolclass=InstrumentedAsyncQueuePool,
+        **POOL_OPTIONS,
+    )
+    pool_metrics["primary_async"] = PoolMetrics(async_engine.sync_engine)
+    time_queries(async_engine.sync_engine, settings.slow_query_seconds)
+    AsyncSessionLocal = sessionmaker(
+        bind=async_engine,
+        class_=AsyncSession,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
 Base = declarative_base()
 
 
-def get_db():
-    db = SessionLocal()
+class ThreadpoolSession:
+    """
+    Awaitable facade over a sync Session, covering the part of the AsyncSession
+    API the routers use, so one set of async endpoints serves both modes.
+    Blocking calls run in Starlette's threadpool.
+    """
+
+    def __init__(self, session: Session):
+        self.sync_session = session
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    async def execute(self, statement, *args, **kwargs):
+        return await run_in_threadpool(
+            self.sync_session.execute, statement, *args, **kwargs
+        )
+
+    async def stream(self, statement, *args, **kwargs):
+        result = await run_in_threadpool(
+            self.sync_session.execute,
+            statement.execution_options(stream_results=True),
+            *args,
+            **kwargs,
+        )
+        return ThreadpoolResult(result)
+
+    async def scalar(self, statement, *args, **kwargs):
+        return await run_in_threadpool(
+            self.sync_session.scalar, statement, *args, **kwargs
+        )
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+
+class ThreadpoolResult:
+    """
+    Server-side cursor result fetched in batches from the threadpool, like
+    AsyncResult.partitions
+    """
+
+    def __init__(self, result):
+        self.result = result
+
+    async def partitions(self, size: int = None):
+        while True:
+            rows = await run_in_threadpool(self.result.fetchmany, size)
+            if not rows:
+                return
+            yield rows
+
+
+class ReplicaSet:
+    """
+    Round-robin over read replica session factories. Clients written to
+    within the stickiness window keep reading from the primary so they see
+    their own writes; the window is per process.
+    """
+
+    def __init__(self, session_factories: list, sticky_seconds: float):
+        self.session_factories = list(session_factories)
+        self._next = cycle(self.session_factories)
+        self.recent_writes = TTLCache(settings.client_cache_size, ttl=sticky_seconds)
+
+    def mark_written(self, client_id):
+        self.recent_writes.set(str(client_id), True)
+
+    def session(self, client_id):
+        """
+        A new replica session for reads of the client, or None when they
+        must go to the primary
+        """
+        if not self.session_factories or self.recent_writes.get(str(client_id)):
+            return None
+        return next(self._next)()
+
+
+def replica_session_factory(name: str, url: str):
+    if settings.database_async:
+        replica_engine = create_async_engine(
+            make_url(url).set(drivername="postgresql+asyncpg"),
+            poolclass=InstrumentedAsyncQueuePool,
+            **POOL_OPTIONS,
+        )
+        pool_metrics[name] = PoolMetrics(replica_engine.sync_engine)
+        time_queries(replica_engine.sync_engine, settings.slow_query_seconds)
+        return sessionmaker(
+            bind=replica_engine,
+            class_=AsyncSession,
+            autoflush=False,
+            expire_on_commit=False,
+        )
+    replica_engine = create_engine(url, poolclass=InstrumentedQueuePool, **POOL_OPTIONS)
+    pool_metrics[name] = PoolMetrics(replica_engine)
+    time_queries(replica_engine, settings.slow_query_seconds)
+    ReplicaSessionLocal = sessionmaker(
+        autocommit=False, autoflush=False, bind=replica_engine
+    )
+    return lambda: ThreadpoolSession(ReplicaSessionLocal())
+
+
+replicas = ReplicaSet(
+    (
+        replica_session_factory(f"replica_{index}", url)
+        for index, url in enumerate(settings.database_replica_urls)
+    ),
+    settings.database_replica_sticky_seconds,
+)
+
+
+@asynccontextmanager
+async def session_scope():
+    if settings.database_async:
+        db = AsyncSessionLocal()
+    else:
+        db = ThreadpoolSession(SessionLocal())
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
+
+
+async def get_db():
+    async with session_scope() as db:
+        yield db
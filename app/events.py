@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import Optional
+import orjson
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# How long browsers wait before reconnecting a closed stream
+RETRY_MS = 3000
+
+
+class Subscription:
+    def __init__(self, client_id: Optional[int], queue_size: int):
+        self.client_id = client_id
+        self.queue = asyncio.Queue(queue_size)
+
+
+class EventBroker:
+    """
+    Fans the appointment notifications received by the worker's one listener
+    connection out to the event streams of the affected client, and to the
+    streams subscribed to every client (client_id None). publish runs on the
+    listener thread and hands each event over to the event loop.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.subscriptions = defaultdict(set)
+        self.loop = None
+
+    def subscribe(self, client_id: Optional[int]) -> Subscription:
+        self.loop = asyncio.get_running_loop()
+        subscription = Subscription(client_id, self.queue_size)
+        self.subscriptions[client_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self.subscriptions.get(subscription.client_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.subscriptions[subscription.client_id]
+
+    def publish(self, payload: str):
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self.dispatch, orjson.loads(payload))
+
+    def dispatch(self, event: dict):
+        for key in (event["client_id"], None):
+            for subscription in list(self.subscriptions.get(key, ())):
+                try:
+                    subscription.queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # A stream that cannot keep up is closed rather than left
+                    # to buffer without bound; the client reconnects and
+                    # reloads its appointments, so its backlog is discarded
+                    logger.warning(
+                        "Dropping event subscriber of client %s",
+                        subscription.client_id,
+                    )
+                    self.unsubscribe(subscription)
+                    while not subscription.queue.empty():
+                        subscription.queue.get_nowait()
+                    subscription.queue.put_nowait(None)
+
+    async def stream(
+        self,
+        client_id: Optional[int],
+        heartbeat_seconds: float,
+        until: Optional[float] = None,
+    ):
+        """
+        Yields the subscription's events in the server-sent events format,
+        with a comment line every heartbeat_seconds to keep proxies from
+        closing the connection, until the time.time() deadline until
+        """
+        subscription = self.subscribe(client_id)
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            while True:
+                timeout = heartbeat_seconds
+                if until is not None:
+                    timeout = min(timeout, until - time.time())
+                    if timeout <= 0:
+                        return
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    return
+                data = orjson.dumps(event).decode()
+                yield f"event: {event['event']}\ndata: {data}\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    @property
+    def subscribers(self) -> int:
+        return sum(len(subscribers) for subscribers in self.subscriptions.values())
+
+
+broker = EventBroker(settings.appointment_events_queue_size)
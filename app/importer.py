@@ -0,0 +1,328 @@
+"""
+Bulk import of clients and their appointment history.
+
+    python -m app.importer --clients clients.csv --appointments appointments.jsonl
+
+Rows are read from CSV (with a header) or JSON lines, validated, and loaded
+into temporary staging tables with COPY, then merged into clients and
+appointments in one transaction. Passwords are hashed on a process pool.
+Clients whose email is already registered, or repeated in the file, are
+skipped (or updated with --update-existing, keeping their password);
+appointments are matched to clients by email and skipped when the client
+already has one that day. The appointment version and event triggers are
+disabled for the merge: imported history is not streamed as events, and each
+client's version is bumped once.
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator
+from pydantic import ValidationError
+from . import schemas, utils
+from .config import settings
+from .database import engine
+from .notify import CLIENT_CHANGED
+
+logger = logging.getLogger(__name__)
+
+CLIENT_FIELDS = ("name", "email", "phone_number", "password", "address")
+APPOINTMENT_FIELDS = ("client_email", "date", "description", "price", "paid")
+# Triggers the appointment merge does without
+TRIGGERS = ("appointments_bump_client_version_insert", "appointments_notify_changed")
+
+
+def read_rows(path: str) -> Iterator[dict]:
+    with open(path, newline="") as file:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def batches(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def copy_value(value) -> str:
+    """
+    A value in COPY's text format
+    """
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_rows(cursor, table: str, columns: tuple, rows: list):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(copy_value(value) for value in row) + "\n")
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def set_triggers(cursor, enabled: bool):
+    for trigger in TRIGGERS:
+        action = "ENABLE" if enabled else "DISABLE"
+        cursor.execute(f"ALTER TABLE appointments {action} TRIGGER {trigger}")
+
+
+class Progress:
+    def __init__(self, label: str):
+        self.label = label
+        self.rows = 0
+        self.start = time.perf_counter()
+
+    def add(self, rows: int):
+        self.rows += rows
+        logger.info("%s: %d rows (%.0f rows/s)", self.label, self.rows, self.rate)
+
+    @property
+    def rate(self) -> float:
+        return self.rows / max(time.perf_counter() - self.start, 1e-9)
+
+
+def validate(model, rows: list, first_line: int, invalid: list) -> list:
+    """
+    (line number, model) of the valid rows; the others are added to invalid
+    """
+    valid = []
+    for number, row in enumerate(rows, first_line):
+        try:
+            valid.append((number, model(**row)))
+        except (ValidationError, TypeError) as error:
+            invalid.append({"line": number, "error": str(error).replace("\n", " ")})
+    return valid
+
+
+def import_clients(
+    connection,
+    rows: Iterable[dict],
+    workers: int = 1,
+    batch_size: int = 5000,
+    update_existing: bool = False,
+) -> dict:
+    """
+    Stages and merges clients, returning counts of what happened to the rows
+    and the ids of the existing clients that were updated
+    """
+    progress = Progress("clients")
+    invalid = []
+    with connection.cursor() as cursor, ProcessPoolExecutor(workers) as pool:
+        cursor.execute(
+            """
+            CREATE TEMPORARY TABLE import_clients (
+                line integer, name text, email text, phone_number text,
+                password text, address text
+            ) ON COMMIT DROP
+            """
+        )
+        line = 1
+        for batch in batches(rows, batch_size):
+            clients = validate(schemas.POSTClientInput, batch, line, invalid)
+            line += len(batch)
+            passwords = pool.map(
+                utils.hash,
+                (client.password for _, client in clients),
+                chunksize=max(1, len(clients) // (4 * workers)),
+            )
+            copy_rows(
+                cursor,
+                "import_clients",
+                ("line",) + CLIENT_FIELDS,
+                [
+                    (
+                        number,
+                        client.name,
+                        client.email,
+                        client.phone_number,
+                        password,
+                        client.address,
+                    )
+                    for (number, client), password in zip(clients, passwords)
+                ],
+            )
+            progress.add(len(batch))
+
+        # The first occurrence of an email in the file wins
+        cursor.execute(
+            """
+            CREATE TEMPORARY TABLE import_clients_unique ON COMMIT DROP AS
+            SELECT DISTINCT ON (email) * FROM import_clients ORDER BY email, line
+            """
+        )
+        cursor.execute(
+            """
+            INSERT INTO clients (name, email, phone_number, password, address)
+            SELECT name, email, phone_number, password, address
+            FROM import_clients_unique ORDER BY line
+            ON CONFLICT (email) DO NOTHING
+            RETURNING id
+            """
+        )
+        created = [id for id, in cursor.fetchall()]
+        updated = set()
+        if update_existing:
+            cursor.execute(
+                """
+                UPDATE clients
+                SET version = clients.version + 1,
+                    name = staged.name,
+                    phone_number = staged.phone_number,
+                    address = staged.address
+                FROM import_clients_unique AS staged
+                WHERE clients.email = staged.email AND clients.id <> ALL(%s)
+                RETURNING clients.id
+                """,
+                (created,),
+            )
+            updated = {id for id, in cursor.fetchall()}
+        if created and settings.client_cache_notify:
+            cursor.execute(
+                "SELECT pg_notify(%s, id::text) FROM unnest(%s) AS id",
+                (CLIENT_CHANGED, created),
+            )
+
+    staged = progress.rows - len(invalid)
+    return {
+        "rows": progress.rows,
+        "rows_per_second": progress.rate,
+        "created": len(created),
+        "updated": len(updated),
+        "skipped": staged - len(created) - len(updated),
+        "invalid": invalid,
+    }, updated
+
+
+def import_appointments(connection, rows: Iterable[dict], batch_size: int = 5000):
+    """
+    Stages and merges appointments, returning counts of what happened to the
+    rows and the ids of the clients that received some
+    """
+    progress = Progress("appointments")
+    invalid = []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            CREATE TEMPORARY TABLE import_appointments (
+                line integer, client_email text, date date, description text,
+                price double precision, paid boolean
+            ) ON COMMIT DROP
+            """
+        )
+        line = 1
+        for batch in batches(rows, batch_size):
+            appointments = validate(schemas.ImportAppointment, batch, line, invalid)
+            line += len(batch)
+            copy_rows(
+                cursor,
+                "import_appointments",
+                ("line",) + APPOINTMENT_FIELDS,
+                [
+                    (
+                        number,
+                        appointment.client_email,
+                        appointment.date.isoformat(),
+                        appointment.description,
+                        appointment.price,
+                        "t" if appointment.paid else "f",
+                    )
+                    for number, appointment in appointments
+                ],
+            )
+            progress.add(len(batch))
+
+        cursor.execute(
+            """
+            SELECT count(*) FROM import_appointments AS staged
+            WHERE NOT EXISTS (
+                SELECT 1 FROM clients WHERE clients.email = staged.client_email
+            )
+            """
+        )
+        unknown_client = cursor.fetchone()[0]
+        set_triggers(cursor, False)
+        cursor.execute(
+            """
+            INSERT INTO appointments (client_id, date, description, price, paid)
+            SELECT clients.id, staged.date, staged.description, staged.price,
+                staged.paid
+            FROM import_appointments AS staged
+            JOIN clients ON clients.email = staged.client_email
+            ORDER BY staged.line
+            ON CONFLICT (client_id, date) DO NOTHING
+            RETURNING client_id
+            """
+        )
+        client_ids = {client_id for client_id, in cursor.fetchall()}
+        created = cursor.rowcount
+        cursor.execute(
+            "UPDATE clients SET version = version + 1 WHERE id = ANY(%s)",
+            (list(client_ids),),
+        )
+        set_triggers(cursor, True)
+
+    staged = progress.rows - len(invalid)
+    return {
+        "rows": progress.rows,
+        "rows_per_second": progress.rate,
+        "created": created,
+        "unknown_client": unknown_client,
+        "skipped": staged - created - unknown_client,
+        "invalid": invalid,
+    }, client_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", help="CSV or JSON lines file of clients")
+    parser.add_argument("--appointments", help="CSV or JSON lines of appointments")
+    parser.add_argument("--update-existing", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    if not (args.clients or args.appointments):
+        parser.error("nothing to import")
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    report = {}
+    connection = engine.raw_connection()
+    try:
+        if args.clients:
+            report["clients"], _ = import_clients(
+                connection,
+                read_rows(args.clients),
+                args.workers,
+                args.batch_size,
+                args.update_existing,
+            )
+        if args.appointments:
+            report["appointments"], _ = import_appointments(
+                connection, read_rows(args.appointments), args.batch_size
+            )
+        connection.commit()
+    finally:
+        connection.close()
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from contextlib import suppress
+from datetime import datetime, timezone
+from threading import Lock
+from fastapi import HTTPException, status
+from sqlalchemy import String, TIMESTAMP, column, insert, select, values
+from . import models
+from .config import settings
+from .database import session_scope
+
+logger = logging.getLogger(__name__)
+
+
+class RequestBuffer:
+    """
+    Accepts service requests in memory and writes them with one multi-row
+    insert per batch, either once max_rows are waiting or every flush_ms.
+    Submitting never waits on the database; past max_pending rows it sheds
+    load with 503 instead.
+    """
+
+    def __init__(self, max_rows: int, flush_ms: int, max_pending: int):
+        self.max_rows = max_rows
+        self.flush_seconds = flush_ms / 1000
+        self.max_pending = max_pending
+        self.session_scope = session_scope
+        self.pending = []
+        self.written = 0
+        self._lock = Lock()
+        self._flushing = None
+        self._task = None
+
+    def submit(self, email: str, description: str):
+        row = {
+            "date_made": datetime.now(timezone.utc),
+            "email": email,
+            "description": description,
+        }
+        with self._lock:
+            if len(self.pending) >= self.max_pending:
+                raise HTTPException(
+                    status.HTTP_503_SERVICE_UNAVAILABLE,
+                    "Server busy, try again later",
+                    headers={"Retry-After": "1"},
+                )
+            self.pending.append(row)
+            full = len(self.pending) >= self.max_rows
+        if full:
+            self._start_flush()
+
+    def _start_flush(self) -> asyncio.Task:
+        # One flush at a time, whether the buffer filled up or the timer fired
+        if self._flushing is None:
+            self._flushing = asyncio.create_task(self.flush())
+            self._flushing.add_done_callback(self._flushed)
+        return self._flushing
+
+    def _flushed(self, _):
+        self._flushing = None
+
+    async def flush(self):
+        while True:
+            with self._lock:
+                rows, self.pending = (
+                    self.pending[: self.max_rows],
+                    self.pending[self.max_rows :],
+                )
+            if not rows:
+                return
+            try:
+                async with self.session_scope() as db:
+                    await db.execute(insert_requests(rows))
+                    await db.commit()
+            except Exception:
+                logger.exception("Writing %d service requests failed", len(rows))
+                with self._lock:
+                    # Retried with the next flush, as far as the cap allows
+                    room = max(self.max_pending - len(self.pending), 0)
+                    self.pending[:0] = rows[:room]
+                return
+            self.written += len(rows)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            # Stopping cancels the timer, never a batch halfway through
+            await asyncio.shield(self._start_flush())
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops the timer, lets a running flush finish, then writes what is
+        left
+        """
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        if self._flushing is not None:
+            await self._flushing
+        await self.flush()
+
+
+def insert_requests(rows: list):
+    """
+    One INSERT ... SELECT for the batch, linking each request to the client
+    registered under its email, if any
+    """
+    batch = values(
+        column("date_made", TIMESTAMP(timezone=True)),
+        column("email", String),
+        column("description", String),
+        name="batch",
+    ).data([(row["date_made"], row["email"], row["description"]) for row in rows])
+    return insert(models.Request).from_select(
+        ["date_made", "email", "description", "client_id"],
+        select(
+            batch.c.date_made,
+            batch.c.email,
+            batch.c.description,
+            models.Client.id,
+        ).outerjoin(models.Client, models.Client.email == batch.c.email),
+    )
+
+
+buffer = RequestBuffer(
+    settings.request_batch_size,
+    settings.request_flush_ms,
+    settings.request_buffer_max,
+)
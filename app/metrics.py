@@ -0,0 +1,483 @@
+import logging
+import re
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from sub-millisecond up to the default pool timeout
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram; quantiles are interpolated within a bucket.
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index else 0.0
+                if index == len(self.buckets):
+                    return lower
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def snapshot(self) -> dict:
+        cumulative = 0
+        buckets = {}
+        for bound, bucket_count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += bucket_count
+            buckets[str(bound)] = cumulative
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class PoolMetrics:
+    """
+    Connection pool statistics gathered from SQLAlchemy pool events, plus the
+    time callers spend waiting for a connection at checkout.
+    """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.soft_invalidations = 0
+        self.checkout_wait = Histogram()
+
+        pool = engine.pool
+        pool.metrics = self
+        event.listen(pool, "connect", self._on_connect)
+        event.listen(pool, "checkout", self._on_checkout)
+        event.listen(pool, "checkin", self._on_checkin)
+        event.listen(pool, "invalidate", self._on_invalidate)
+        event.listen(pool, "soft_invalidate", self._on_soft_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.checkouts += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        self.checkins += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        self.invalidations += 1
+
+    def _on_soft_invalidate(self, dbapi_connection, connection_record, exception):
+        self.soft_invalidations += 1
+
+    def snapshot(self) -> dict:
+        pool = self.engine.pool
+        return {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "invalidations": self.invalidations,
+            "soft_invalidations": self.soft_invalidations,
+            "checkout_wait_seconds": self.checkout_wait.snapshot(),
+        }
+
+
+class _TimedCheckout:
+    """
+    Times QueuePool._do_get, which blocks while the pool is exhausted; no pool
+    event fires before a checkout starts waiting.
+    """
+
+    metrics: PoolMetrics = None
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.metrics is not None:
+                self.metrics.checkout_wait.observe(perf_counter() - start)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+class InstrumentedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+class RequestTimer:
+    """
+    Time one request spent in each component, and the statements it ran.
+    Shared by reference with the threadpool, since run_in_threadpool copies
+    the context.
+    """
+
+    __slots__ = ("db", "hashing", "serialization", "path", "statements")
+
+    def __init__(self, path: str = None):
+        self.db = 0.0
+        self.hashing = 0.0
+        self.serialization = 0.0
+        self.path = path
+        self.statements = {}
+
+    @property
+    def queries(self) -> int:
+        return sum(self.statements.values())
+
+
+request_timer: ContextVar[Optional[RequestTimer]] = ContextVar(
+    "request_timer", default=None
+)
+
+COMPONENTS = ("db", "hashing", "serialization")
+
+SECRET_PARAMETER = re.compile("password|secret|token|sig", re.IGNORECASE)
+REDACTED = "<redacted>"
+
+
+@contextmanager
+def timed(component: str):
+    timer = request_timer.get()
+    if timer is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        setattr(timer, component, getattr(timer, component) + perf_counter() - start)
+
+
+def scrub_parameters(parameters, context=None, many: bool = False):
+    """
+    Statement parameters with the values of secret-looking parameters
+    replaced. Positional parameters are named through the compiled statement,
+    and redacted entirely when it is not available.
+    """
+    if many:
+        return [scrub_parameters(each, context) for each in parameters]
+    if isinstance(parameters, dict):
+        return {
+            name: REDACTED if SECRET_PARAMETER.search(name) else value
+            for name, value in parameters.items()
+        }
+    names = getattr(getattr(context, "compiled", None), "positiontup", None)
+    if names is None or len(names) != len(parameters):
+        return REDACTED
+    return scrub_parameters(dict(zip(names, parameters)))
+
+
+def time_queries(engine: Engine, slow_query_seconds: float = None):
+    """
+    Adds the time spent executing statements on the engine to the current
+    request's DB time, counts them by statement text and logs those slower
+    than slow_query_seconds
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_start", []).append(perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        elapsed = perf_counter() - conn.info["query_start"].pop()
+        timer = request_timer.get()
+        if timer is not None:
+            timer.db += elapsed
+            timer.statements[statement] = timer.statements.get(statement, 0) + 1
+        if slow_query_seconds and elapsed >= slow_query_seconds:
+            logger.warning(
+                "Slow query (%.3fs) in %s: %s %r",
+                elapsed,
+                timer.path if timer is not None else "-",
+                statement,
+                scrub_parameters(parameters, context, many),
+            )
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.latency = Histogram()
+        self.statuses = {}
+        self.seconds = dict.fromkeys(COMPONENTS, 0.0)
+        self.queries = 0
+        self.repeated_queries = 0
+        self._lock = Lock()
+
+    def observe(
+        self,
+        status_code: int,
+        seconds: float,
+        timer: RequestTimer,
+        repeated: bool = False,
+    ):
+        self.latency.observe(seconds)
+        with self._lock:
+            self.statuses[status_code] = self.statuses.get(status_code, 0) + 1
+            for component in COMPONENTS:
+                self.seconds[component] += getattr(timer, component)
+            self.queries += timer.queries
+            self.repeated_queries += repeated
+
+    def snapshot(self) -> dict:
+        return {
+            "statuses": dict(self.statuses),
+            "latency_seconds": self.latency.snapshot(),
+            **{
+                f"{component}_seconds": self.seconds[component]
+                for component in COMPONENTS
+            },
+            "queries": self.queries,
+            "repeated_queries": self.repeated_queries,
+        }
+
+
+class RequestMetrics:
+    """
+    Per-route request statistics, keyed by method and route template so the
+    number of series stays bounded
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self._lock = Lock()
+
+    def route(self, method: str, path: str) -> RouteMetrics:
+        route = self.routes.get((method, path))
+        if route is None:
+            with self._lock:
+                route = self.routes.setdefault((method, path), RouteMetrics())
+        return route
+
+    def snapshot(self) -> dict:
+        return {
+            f"{method} {path}": route.snapshot()
+            for (method, path), route in self.routes.items()
+        }
+
+
+request_metrics = RequestMetrics()
+
+
+class TimingMiddleware:
+    """
+    Pure ASGI middleware timing every HTTP request, so the endpoint runs in
+    the same task and context as the timer. Requests that run one statement
+    repeated_query_threshold times or more are logged as likely N+1 queries;
+    query_header adds the statement count as X-DB-Queries.
+    """
+
+    def __init__(
+        self,
+        app,
+        metrics: RequestMetrics = request_metrics,
+        repeated_query_threshold: int = 0,
+        query_header: bool = False,
+    ):
+        self.app = app
+        self.metrics = metrics
+        self.repeated_query_threshold = repeated_query_threshold
+        self.query_header = query_header
+        self._paths = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timer = RequestTimer(f"{scope['method']} {scope['path']}")
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.query_header:
+                    header = (b"x-db-queries", str(timer.queries).encode())
+                    message["headers"] = [*message.get("headers", ()), header]
+            await send(message)
+
+        token = request_timer.set(timer)
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = perf_counter() - start
+            request_timer.reset(token)
+            route = self.metrics.route(scope["method"], self.route_path(scope))
+            route.observe(status_code, elapsed, timer, self.check_repeated(timer))
+
+    def check_repeated(self, timer: RequestTimer) -> bool:
+        if not self.repeated_query_threshold or not timer.statements:
+            return False
+        statement, count = max(timer.statements.items(), key=lambda item: item[1])
+        if count < self.repeated_query_threshold:
+            return False
+        logger.warning(
+            "%s ran the same query %d times, likely N+1: %s",
+            timer.path,
+            count,
+            statement,
+        )
+        return True
+
+    def route_path(self, scope) -> str:
+        # The router adds the matched endpoint to the scope
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._paths.get(endpoint)
+        if path is None:
+            self._paths = {
+                getattr(route, "endpoint", None): route.path
+                for route in scope["app"].routes
+            }
+            path = self._paths.get(endpoint, "unmatched")
+        return path
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{name}="{value}"' for name, value in labels.items())
+
+
+def _histogram_lines(name: str, labels: str, histogram: Histogram) -> list:
+    separator = "," if labels else ""
+    lines = []
+    cumulative = 0
+    for bound, bucket_count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+        cumulative += bucket_count
+        lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
+
+
+def render_prometheus(
+    requests: RequestMetrics,
+    pools: dict,
+    caches: dict,
+    rate_limited: dict = None,
+    prefix: str = "lawncare",
+) -> str:
+    """
+    Prometheus text exposition of the request, pool and cache statistics,
+    and of the requests rejected by every rate limit budget
+    """
+    lines = [f"# TYPE {prefix}_request_duration_seconds histogram"]
+    routes = list(requests.routes.items())
+    for (method, path), route in routes:
+        labels = _labels(method=method, route=path)
+        lines += _histogram_lines(
+            f"{prefix}_request_duration_seconds", labels, route.latency
+        )
+    lines.append(f"# TYPE {prefix}_requests_total counter")
+    for (method, path), route in routes:
+        for status_code, count in list(route.statuses.items()):
+            labels = _labels(method=method, route=path, status=status_code)
+            lines.append(f"{prefix}_requests_total{{{labels}}} {count}")
+    for field in ("queries", "repeated_queries"):
+        name = f"{prefix}_request_{field}_total"
+        lines.append(f"# TYPE {name} counter")
+        for (method, path), route in routes:
+            labels = _labels(method=method, route=path)
+            lines.append(f"{name}{{{labels}}} {getattr(route, field)}")
+    for component in COMPONENTS:
+        name = f"{prefix}_request_{component}_seconds_total"
+        lines.append(f"# TYPE {name} counter")
+        for (method, path), route in routes:
+            labels = _labels(method=method, route=path)
+            lines.append(f"{name}{{{labels}}} {route.seconds[component]}")
+
+    pool_snapshots = {name: metrics.snapshot() for name, metrics in pools.items()}
+    for field in ("size", "checked_in", "checked_out", "overflow"):
+        lines.append(f"# TYPE {prefix}_pool_{field} gauge")
+        for name, snapshot in pool_snapshots.items():
+            lines.append(f'{prefix}_pool_{field}{{pool="{name}"}} {snapshot[field]}')
+    for field in ("connects", "checkouts", "checkins", "invalidations"):
+        lines.append(f"# TYPE {prefix}_pool_{field}_total counter")
+        for name, snapshot in pool_snapshots.items():
+            lines.append(
+                f'{prefix}_pool_{field}_total{{pool="{name}"}} {snapshot[field]}'
+            )
+    lines.append(f"# TYPE {prefix}_pool_checkout_wait_seconds histogram")
+    for name, metrics in pools.items():
+        lines += _histogram_lines(
+            f"{prefix}_pool_checkout_wait_seconds",
+            _labels(pool=name),
+            metrics.checkout_wait,
+        )
+
+    cache_stats = {name: cache.stats() for name, cache in caches.items()}
+    for field, kind in (("hits", "counter"), ("misses", "counter"), ("size", "gauge")):
+        name = f"{prefix}_cache_{field}" + ("_total" if kind == "counter" else "")
+        lines.append(f"# TYPE {name} {kind}")
+        for cache, stats in cache_stats.items():
+            if field in stats:
+                lines.append(f'{name}{{cache="{cache}"}} {stats[field]}')
+
+    lines.append(f"# TYPE {prefix}_rate_limited_total counter")
+    for budget, count in (rate_limited or {}).items():
+        lines.append(f'{prefix}_rate_limited_total{{budget="{budget}"}} {count}')
+    return "\n".join(lines) + "\n"
@@ -1,4 +1,6 @@
-from sqlalchemy import Column, ForeignKey, Integer, Float, String
+from sqlalchemy import Column, DDL, ForeignKey, Index, Integer, Float, String
+from sqlalchemy import UniqueConstraint, event
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql.sqltypes import Date, TIMESTAMP, Boolean
 from sqlalchemy.sql.expression import text
 from sqlalchemy.orm import relationship
@@ -17,10 +19,19 @@ class Client(Base):
     phone_number = Column(String(length=22), nullable=False)
     password = Column(String, nullable=False)
     address = Column(String, nullable=False)
+    # Bumped by a trigger whenever one of the client's appointments changes
+    version = Column(Integer, nullable=False, server_default=text("0"))
 
 
 class Appointment(Base):
     __tablename__ = "appointments"
+    __table_args__ = (
+        Index("appointments_date_idx", "date"),
+        UniqueConstraint("client_id", "date", name="appointments_client_id_date_key"),
+        Index(
+            "appointments_unpaid_date_idx", "date", postgresql_where=text("NOT paid")
+        ),
+    )
 
     id = Column(Integer, primary_key=True, nullable=False)
     date = Column(Date, nullable=False)
@@ -31,18 +42,133 @@ class Appointment(Base):
     client_id = Column(
         Integer, ForeignKey("clients.id", ondelete="CASCADE"), nullable=False
     )
-    client = relationship("Client")
+    client = relationship("Client", lazy="raise")
+
+
+# Once per statement, for each client whose appointments it changed;
+# transition tables allow a single event per trigger
+event.listen(
+    Appointment.__table__,
+    "after_create",
+    DDL(
+        """
+        CREATE OR REPLACE FUNCTION bump_client_version() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE clients SET version = version + 1
+                WHERE id IN (SELECT client_id FROM new_rows);
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE clients SET version = version + 1
+                WHERE id IN (SELECT client_id FROM old_rows);
+            ELSE
+                UPDATE clients SET version = version + 1
+                WHERE id IN (
+                    SELECT client_id FROM new_rows
+                    UNION SELECT client_id FROM old_rows
+                );
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER appointments_bump_client_version_insert
+        AFTER INSERT ON appointments REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_client_version();
+
+        CREATE TRIGGER appointments_bump_client_version_update
+        AFTER UPDATE ON appointments
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_client_version();
+
+        CREATE TRIGGER appointments_bump_client_version_delete
+        AFTER DELETE ON appointments REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_client_version();
+        """
+    ),
+)
+
+# Feeds the appointment event streams through LISTEN/NOTIFY
+event.listen(
+    Appointment.__table__,
+    "after_create",
+    DDL(
+        """
+        CREATE OR REPLACE FUNCTION notify_appointment_changed() RETURNS trigger AS $$
+        DECLARE
+            appointment appointments;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                appointment := OLD;
+            ELSE
+                appointment := NEW;
+            END IF;
+            PERFORM pg_notify('appointment_changed', json_build_object(
+                'event', CASE TG_OP
+                    WHEN 'INSERT' THEN 'created'
+                    WHEN 'DELETE' THEN 'cancelled'
+                    ELSE 'paid' END,
+                'id', appointment.id,
+                'client_id', appointment.client_id,
+                'date', appointment.date,
+                'paid', appointment.paid
+            )::text);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER appointments_notify_changed
+        AFTER INSERT OR DELETE ON appointments
+        FOR EACH ROW EXECUTE FUNCTION notify_appointment_changed();
+
+        CREATE TRIGGER appointments_notify_paid
+        AFTER UPDATE OF paid ON appointments
+        FOR EACH ROW WHEN (OLD.paid IS DISTINCT FROM NEW.paid)
+        EXECUTE FUNCTION notify_appointment_changed();
+        """
+    ),
+)
 
 
 class Request(Base):
     __tablename__ = "requests"
+    __table_args__ = (Index("requests_date_made_idx", "date_made", "id"),)
 
     id = Column(Integer, primary_key=True, nullable=False)
     date_made = Column(
         TIMESTAMP(timezone=True), nullable=False, server_default=text("now()")
     )
-    email = Column(String, unique=True, nullable=False)
+    email = Column(String, nullable=False)
     description = Column(String, server_default="", nullable=False)
 
     client_id = Column(Integer, ForeignKey("clients.id", ondelete="CASCADE"))
-    client = relationship("Client")
+    client = relationship("Client", lazy="raise")
+
+
+class Notification(Base):
+    """
+    Transactional outbox: written in the same commit as the change it
+    announces and sent by the outbox worker
+    """
+
+    __tablename__ = "outbox"
+    __table_args__ = (
+        Index(
+            "outbox_pending_idx",
+            "next_attempt_at",
+            postgresql_where=text("sent_at IS NULL"),
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    created_at = Column(
+        TIMESTAMP(timezone=True), nullable=False, server_default=text("now()")
+    )
+    kind = Column(String, nullable=False)
+    recipient = Column(String, nullable=False)
+    payload = Column(JSONB, nullable=False, server_default=text("'{}'"))
+    attempts = Column(Integer, nullable=False, server_default=text("0"))
+    next_attempt_at = Column(
+        TIMESTAMP(timezone=True), nullable=False, server_default=text("now()")
+    )
+    sent_at = Column(TIMESTAMP(timezone=True))
+    last_error = Column(String)
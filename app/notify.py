@@ -0,0 +1,86 @@
+import logging
+import select
+from collections import defaultdict
+from threading import Event, Thread
+from typing import Callable
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import SQLALCHEMY_DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+CLIENT_CHANGED = "client_changed"
+# Sent by the appointments triggers, with the change as JSON
+APPOINTMENT_CHANGED = "appointment_changed"
+
+
+class Listener:
+    """
+    One Postgres connection per worker that LISTENs on every subscribed
+    channel and hands each notification's payload to the channel's callbacks.
+    Callbacks run on the listener thread and must not block.
+    """
+
+    def __init__(self, dsn: str, poll_seconds: float = 1.0):
+        self.dsn = dsn
+        self.poll_seconds = poll_seconds
+        self.callbacks = defaultdict(list)
+        self._stopping = Event()
+        self._thread = None
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]):
+        self.callbacks[channel].append(callback)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = Thread(target=self._run, name="pg-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self._listen()
+            except psycopg2.Error:
+                logger.exception("Listener connection lost, reconnecting")
+                self._stopping.wait(self.poll_seconds)
+
+    def _listen(self):
+        connection = psycopg2.connect(self.dsn)
+        try:
+            connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with connection.cursor() as cursor:
+                for channel in self.callbacks:
+                    cursor.execute(f'LISTEN "{channel}"')
+            while not self._stopping.is_set():
+                if not select.select([connection], [], [], self.poll_seconds)[0]:
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notification = connection.notifies.pop(0)
+                    for callback in self.callbacks[notification.channel]:
+                        try:
+                            callback(notification.payload)
+                        except Exception:
+                            logger.exception("Listener callback failed")
+        finally:
+            connection.close()
+
+
+async def notify(db: AsyncSession, channel: str, payload: str):
+    """
+    Queues a notification that Postgres delivers when the transaction commits
+    """
+    await db.execute(func.pg_notify(channel, payload).select())
+
+
+listener = Listener(SQLALCHEMY_DATABASE_URL)
@@ -0,0 +1,331 @@
+"""
+Email notifications through a transactional outbox.
+
+Request handlers add a row to the outbox in the same transaction as the
+change it announces, so a notification is queued exactly when the change
+commits and SMTP never runs on the request path. The worker process
+(python -m app.worker) claims due rows with SELECT ... FOR UPDATE SKIP
+LOCKED and leases them by pushing their next attempt ahead, so several
+workers can drain the table side by side. It sends them over one reused SMTP
+connection, commits each outcome as it goes, and reschedules failures with
+exponential backoff until max_attempts; once the server cannot be reached,
+the rest of the batch is put off without counting an attempt. A row that cannot be rendered or encoded is
+given up on at once, without holding back the rest of its batch.
+"""
+import logging
+import smtplib
+import threading
+from datetime import timedelta
+from email.message import EmailMessage
+import orjson
+from sqlalchemy import (
+    Integer,
+    cast,
+    column,
+    func,
+    insert,
+    literal,
+    select,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+CLIENT_DELETED = "client_deleted"
+APPOINTMENTS_BOOKED = "appointments_booked"
+APPOINTMENTS_CANCELLED = "appointments_cancelled"
+
+TEMPLATES = {
+    CLIENT_DELETED: (
+        "Your account has been closed",
+        "Hello {name},\n\nYour account and its appointments have been removed.\n",
+    ),
+    APPOINTMENTS_BOOKED: (
+        "Appointment booked",
+        "Hello {name},\n\nYou are booked for {dates}.\n",
+    ),
+    APPOINTMENTS_CANCELLED: (
+        "Appointment cancelled",
+        "Hello {name},\n\nYour appointment on {dates} has been cancelled.\n",
+    ),
+}
+
+
+def json_safe(payload: dict) -> dict:
+    # Dates and the like become the strings the API serializes them as
+    return orjson.loads(orjson.dumps(payload))
+
+
+def notification(kind: str, recipient: str, **payload):
+    """
+    Insert of one notification, for recipients no longer in the clients table
+    """
+    return insert(models.Notification).values(
+        kind=kind, recipient=recipient, payload=json_safe(payload)
+    )
+
+
+async def notify_clients(db: AsyncSession, kind: str, payloads: dict):
+    """
+    Queues a notification to each client of {client id: payload} with one
+    INSERT ... SELECT that looks up their email and name
+    """
+    if not payloads:
+        return
+    batch = values(
+        column("client_id", Integer), column("payload", JSONB), name="batch"
+    ).data([(id, json_safe(payload)) for id, payload in payloads.items()])
+    await db.execute(
+        insert(models.Notification).from_select(
+            ["kind", "recipient", "payload"],
+            select(
+                literal(kind),
+                models.Client.email,
+                # VALUES parameters arrive untyped under psycopg2
+                cast(batch.c.payload, JSONB).op("||")(
+                    func.jsonb_build_object("name", models.Client.name)
+                ),
+            )
+            .select_from(batch)
+            .join(models.Client, models.Client.id == batch.c.client_id),
+        )
+    )
+
+
+def render(row) -> EmailMessage:
+    subject, body = TEMPLATES[row.kind]
+    payload = dict(row.payload)
+    if "dates" in payload:
+        payload["dates"] = ", ".join(payload["dates"])
+    message = EmailMessage()
+    message["From"] = settings.smtp_sender
+    message["To"] = row.recipient
+    message["Subject"] = subject
+    message.set_content(body.format_map(payload))
+    return message
+
+
+class Mailer:
+    """
+    One SMTP connection, opened on first use and reused for every message
+    after it; a connection the server dropped is reopened once per message
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str = "",
+        password: str = "",
+        starttls: bool = False,
+        timeout: float = 10,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.connection = None
+
+    def connect(self) -> smtplib.SMTP:
+        if self.connection is None:
+            connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                connection.starttls()
+            if self.username:
+                connection.login(self.username, self.password)
+            self.connection = connection
+        return self.connection
+
+    def send(self, message: EmailMessage):
+        try:
+            self.connect().send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            self.connection = None
+            self.connect().send_message(message)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException):
+            # Refused by the server, the connection itself is still usable
+            raise
+        except OSError:
+            self.connection = None
+            raise
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.quit()
+            except smtplib.SMTPException:
+                pass
+            self.connection = None
+
+
+# Answers about one message; any other OSError means the server cannot be
+# reached
+REFUSED = (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException)
+
+
+class OutboxWorker:
+    def __init__(
+        self,
+        engine,
+        mailer: Mailer,
+        batch_size: int,
+        max_attempts: int,
+        backoff_seconds: float,
+        lease_seconds: float = 600,
+    ):
+        self.engine = engine
+        self.mailer = mailer
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.lease_seconds = lease_seconds
+
+    def claim(self) -> list:
+        """
+        Takes one batch of due notifications. Pushing their next attempt past
+        the lease keeps them from other workers once the claim commits, so no
+        row lock is held while SMTP runs.
+        """
+        Notification = models.Notification
+        with self.engine.begin() as connection:
+            rows = connection.execute(
+                select(Notification)
+                .where(Notification.sent_at.is_(None))
+                .where(Notification.next_attempt_at <= func.now())
+                .where(Notification.attempts < self.max_attempts)
+                .order_by(Notification.next_attempt_at, Notification.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if rows:
+                connection.execute(
+                    update(Notification)
+                    .where(Notification.id.in_([row.id for row in rows]))
+                    .values(
+                        next_attempt_at=func.now()
+                        + timedelta(seconds=self.lease_seconds)
+                    )
+                )
+        return rows
+
+    def drain_once(self) -> dict:
+        """
+        Sends one batch of due notifications, committing the outcome of each
+        message on its own, so a failure later in the batch never causes the
+        messages already delivered to be sent again
+        """
+        rows = self.claim()
+        sent = failed = deferred = 0
+        for index, row in enumerate(rows):
+            try:
+                message = render(row)
+            except (KeyError, IndexError, TypeError, ValueError) as error:
+                # A payload that does not fit its template never will
+                failed += 1
+                self._give_up(row, f"Rendering failed: {error!r}")
+                continue
+            try:
+                self.mailer.send(message)
+            except OSError as error:
+                failed += 1
+                self._retry(row, error)
+                if not isinstance(error, REFUSED) or isinstance(
+                    error, smtplib.SMTPConnectError
+                ):
+                    # Unreachable, the rest of the batch waits as long
+                    deferred = len(rows) - index - 1
+                    self._defer(rows[index + 1 :], error)
+                    break
+            except ValueError as error:
+                # Such as an address smtplib cannot encode
+                failed += 1
+                self._give_up(row, f"Sending failed: {error!r}")
+            else:
+                sent += 1
+                self._sent(row)
+        return {
+            "claimed": len(rows),
+            "sent": sent,
+            "failed": failed,
+            "deferred": deferred,
+        }
+
+    def _sent(self, row):
+        Notification = models.Notification
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(Notification)
+                .where(Notification.id == row.id)
+                .values(attempts=Notification.attempts + 1, sent_at=func.now())
+            )
+
+    def _retry(self, row, error: Exception):
+        Notification = models.Notification
+        delay = self.backoff_seconds * 2**row.attempts
+        logger.warning(
+            "Notification %d to %s failed (attempt %d): %s",
+            row.id,
+            row.recipient,
+            row.attempts + 1,
+            error,
+        )
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(Notification)
+                .where(Notification.id == row.id)
+                .values(
+                    attempts=Notification.attempts + 1,
+                    next_attempt_at=func.now() + timedelta(seconds=delay),
+                    last_error=str(error),
+                )
+            )
+
+    def _defer(self, rows: list, error: Exception):
+        # Not attempted, so no attempt is counted
+        if not rows:
+            return
+        Notification = models.Notification
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(Notification)
+                .where(Notification.id.in_([row.id for row in rows]))
+                .values(
+                    next_attempt_at=func.now()
+                    + timedelta(seconds=self.backoff_seconds),
+                    last_error=str(error),
+                )
+            )
+
+    def _give_up(self, row, error: str):
+        # Out of attempts right away, the row stays for inspection
+        Notification = models.Notification
+        logger.error("Notification %d to %s dropped: %s", row.id, row.recipient, error)
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(Notification)
+                .where(Notification.id == row.id)
+                .values(attempts=self.max_attempts, last_error=error)
+            )
+
+    def run(self, poll_seconds: float, stopping: threading.Event):
+        """
+        Drains full batches back to back and polls when the outbox runs dry
+        """
+        try:
+            while not stopping.is_set():
+                try:
+                    result = self.drain_once()
+                except Exception:
+                    logger.exception("Draining the outbox failed")
+                    result = {"claimed": 0}
+                if result["claimed"] < self.batch_size:
+                    stopping.wait(poll_seconds)
+        finally:
+            self.mailer.close()
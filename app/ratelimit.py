@@ -0,0 +1,239 @@
+import logging
+import math
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from time import time
+from typing import Optional
+import orjson
+from fastapi import HTTPException
+from . import oauth2
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# rate in tokens per second, burst the bucket's capacity
+Budget = namedtuple("Budget", ("rate", "burst"))
+
+
+class MemoryBuckets:
+    """
+    Per-process token buckets, spread over shards that each have their own
+    lock so concurrent requests rarely contend. Every shard keeps its most
+    recently used keys only; an evicted bucket starts over full.
+    """
+
+    def __init__(self, shards: int = 16, max_keys: int = 100000):
+        self.max_keys_per_shard = max(1, max_keys // shards)
+        self._shards = [(Lock(), OrderedDict()) for _ in range(shards)]
+
+    async def take(self, key: str, budget: Budget) -> float:
+        """
+        Takes a token from the key's bucket, returning 0 when one was left,
+        or else the seconds until one will be
+        """
+        lock, buckets = self._shards[hash(key) % len(self._shards)]
+        now = time()
+        with lock:
+            tokens, updated_at = buckets.pop(key, (budget.burst, now))
+            tokens = min(budget.burst, tokens + (now - updated_at) * budget.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / budget.rate
+            buckets[key] = (tokens, now)
+            if len(buckets) > self.max_keys_per_shard:
+                buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        for lock, buckets in self._shards:
+            with lock:
+                buckets.clear()
+
+
+# Same arithmetic as MemoryBuckets.take, atomic in Redis; the key expires
+# once its bucket would be full again
+TAKE_SCRIPT = """
+local budget_rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * budget_rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / budget_rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / budget_rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    """
+    Token buckets shared by every worker, on any client with the
+    redis.asyncio API (eval)
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisBuckets":
+        try:
+            from redis import asyncio as redis
+        except ImportError as error:
+            raise RuntimeError(
+                "RATE_LIMIT_BACKEND=redis requires the redis package"
+            ) from error
+        return cls(redis.from_url(url))
+
+    async def take(self, key: str, budget: Budget) -> float:
+        wait = await self.client.eval(
+            TAKE_SCRIPT, 1, f"ratelimit:{key}", budget.rate, budget.burst, time()
+        )
+        return float(wait)
+
+    def clear(self):
+        pass
+
+
+class RateLimiter:
+    """
+    Picks the budget of a request (login, read or write) and its key: the
+    client id of a valid bearer token, otherwise the client's address.
+    Logins are always keyed by address.
+    """
+
+    def __init__(self, store=None, budgets: dict = None, proxy_hops: int = 0):
+        self.store = store
+        self.budgets = budgets or {}
+        self.proxy_hops = proxy_hops
+        self.rejected = {name: 0 for name in self.budgets}
+
+    def budget_name(self, scope) -> str:
+        if scope["path"] == "/auth/login":
+            return "login"
+        if scope["method"] in ("GET", "HEAD"):
+            return "read"
+        return "write"
+
+    def key(self, scope, budget_name: str) -> str:
+        if budget_name != "login":
+            for name, value in scope["headers"]:
+                if name == b"authorization":
+                    scheme, _, token = value.decode("latin-1").partition(" ")
+                    if scheme.lower() != "bearer":
+                        break
+                    try:
+                        token_data = oauth2.decode_access_token(token)
+                    except HTTPException:
+                        break
+                    return f"{budget_name}:client:{token_data.client_id}"
+        return f"{budget_name}:ip:{self.address(scope)}"
+
+    def address(self, scope) -> str:
+        """
+        The peer's address or, behind proxy_hops proxies, the X-Forwarded-For
+        entry the outermost of them appended
+        """
+        if self.proxy_hops:
+            forwarded = [
+                host.strip()
+                for name, value in scope["headers"]
+                if name == b"x-forwarded-for"
+                for host in value.decode("latin-1").split(",")
+            ]
+            if len(forwarded) >= self.proxy_hops:
+                return forwarded[-self.proxy_hops]
+        return scope["client"][0] if scope.get("client") else "unknown"
+
+    async def check(self, scope) -> float:
+        """
+        Seconds the request has to wait for, 0 if it may proceed
+        """
+        if self.store is None:
+            return 0.0
+        name = self.budget_name(scope)
+        budget = self.budgets.get(name)
+        if budget is None:
+            return 0.0
+        try:
+            wait = await self.store.take(self.key(scope, name), budget)
+        except Exception:
+            # A shared store being down must not take the API down with it
+            logger.exception("Rate limit store failed, letting the request in")
+            return 0.0
+        if wait:
+            self.rejected[name] = self.rejected.get(name, 0) + 1
+        return wait
+
+    def clear(self):
+        self.rejected = {name: 0 for name in self.budgets}
+        if self.store is not None:
+            self.store.clear()
+
+
+class RateLimitMiddleware:
+    """
+    Answers requests over their budget with 429 and Retry-After before they
+    reach routing, the database or password hashing
+    """
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        wait = await self.limiter.check(scope)
+        if not wait:
+            return await self.app(scope, receive, send)
+
+        body = orjson.dumps({"detail": "Too many requests"})
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(math.ceil(wait)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+def per_minute(requests: float, burst: int) -> Budget:
+    return Budget(requests / 60, burst)
+
+
+def make_rate_limiter() -> RateLimiter:
+    budgets = {
+        "login": per_minute(
+            settings.rate_limit_login_per_minute, settings.rate_limit_login_burst
+        ),
+        "read": per_minute(
+            settings.rate_limit_read_per_minute, settings.rate_limit_read_burst
+        ),
+        "write": per_minute(
+            settings.rate_limit_write_per_minute, settings.rate_limit_write_burst
+        ),
+    }
+    backend = settings.rate_limit_backend
+    hops = settings.rate_limit_proxy_hops
+    if backend == "memory":
+        return RateLimiter(MemoryBuckets(), budgets, hops)
+    if backend == "redis":
+        return RateLimiter(
+            RedisBuckets.from_url(settings.rate_limit_url), budgets, hops
+        )
+    return RateLimiter(None, budgets, hops)
+
+
+limiter = make_rate_limiter()
@@ -0,0 +1,13 @@
+from typing import Any
+from fastapi import responses
+from .metrics import timed
+
+
+class ORJSONResponse(responses.ORJSONResponse):
+    """
+    ORJSONResponse that counts rendering towards the request's serialization time
+    """
+
+    def render(self, content: Any) -> bytes:
+        with timed("serialization"):
+            return super().render(content)
@@ -1,26 +1,53 @@
-from fastapi import Depends, HTTPException, status, Response, APIRouter, Request
-from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from fastapi import Depends, HTTPException, status, Response, APIRouter, Request, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, datetime, timedelta
+from typing import List
+import orjson
+import time
 from app import oauth2
-from .. import models, schemas, utils
+from .. import database, events, models, outbox, schemas, tokens, utils
+from ..cache import response_cache
+from ..config import settings
 from ..database import get_db
+from ..metrics import timed
+from ..responses import ORJSONResponse
 
 router = APIRouter(prefix="/appointment", tags=["Appointment"])
 
+# Columns of GETAppointmentReturn; read paths select these instead of entities
+APPOINTMENT_COLUMNS = (
+    models.Appointment.id,
+    models.Appointment.date,
+    models.Appointment.description,
+    models.Appointment.price,
+    models.Appointment.paid,
+)
+
 
 @router.get("", status_code=status.HTTP_200_OK)
-def get_appointments(
+async def get_appointments(
     request: Request,
     client_id: int = None,
     appointment_id: int = None,
     before: int = None,
-    after: str = None,
-    paid: bool = False,
-    db: Session = Depends(get_db),
-    auth_token: schemas.TokenData = Depends(oauth2.verify_access_token),
+    after: int = None,
+    paid: bool = None,
+    limit: int = Query(
+        settings.appointment_page_size, ge=1, le=settings.appointment_page_size_max
+    ),
+    cursor: str = None,
+    stream: bool = False,
+    db: AsyncSession = Depends(oauth2.get_read_db),
+    auth_token: tokens.TokenClaims = Depends(oauth2.get_current_client),
 ):
     if auth_token.testing != "True":
-        oauth2.validate_access_token(request.host, request.port, auth_token)
+        await oauth2.validate_access_token(
+            request.client.host, request.client.port, auth_token
+        )
     if auth_token.client_id != "0":
         if utils.is_set(client_id):
             raise HTTPException(
@@ -35,6 +62,24 @@ def get_appointments(
             "Need to specify client to get appointments from",
         )
 
+    # The client's version changes with every write to its appointments, so a
+    # matching tag or cached response is answered without touching the
+    # appointments table
+    tag = slot = None
+    if not stream:
+        version = await db.scalar(
+            select(models.Client.version).where(models.Client.id == client_id)
+        )
+        if utils.is_set(version):
+            tag = utils.etag("appointments", client_id, version, request.url.query)
+            if utils.etag_matches(request.headers.get("If-None-Match"), tag):
+                return utils.not_modified(tag)
+            cached, slot = await response_cache.get(
+                client_id, version, "appointments", request.url.query
+            )
+            if cached:
+                return utils.from_cache(cached, request.headers.get("If-None-Match"))
+
     if utils.is_set(appointment_id):
         if utils.is_set(before) or utils.is_set(after) or utils.is_set(paid):
             raise HTTPException(
@@ -42,64 +87,361 @@ def get_appointments(
                 "Cannot set constraints when fetching by id",
             )
         appointment = (
-            db.query(models.Appointment)
-            .filter(models.Appointment.id == appointment_id)
-            .first()
-        )
-        if not appointment or appointment.client_id != client_id:
+            await db.execute(
+                select(*APPOINTMENT_COLUMNS)
+                .where(models.Appointment.id == appointment_id)
+                .where(models.Appointment.client_id == client_id)
+            )
+        ).first()
+        if not appointment:
             raise HTTPException(
                 status.HTTP_404_NOT_FOUND,
                 f"Cannot find appointment with id: {appointment_id}",
             )
-        return appointment
+        response = ORJSONResponse(appointment._asdict())
+        return await utils.cache_response(slot, response, tag)
     else:
-        appointments = db.query(models.Appointment).filter(
-            models.Appointment.client_id == client_id
+        appointments = (
+            select(*APPOINTMENT_COLUMNS)
+            .where(models.Appointment.client_id == client_id)
+            .order_by(models.Appointment.date, models.Appointment.id)
         )
         if utils.is_set(before):
-            appointments = appointments.filter(
+            appointments = appointments.where(
                 models.Appointment.date < datetime.fromtimestamp(before)
             )
         if utils.is_set(after):
-            appointments = appointments.filter(
+            appointments = appointments.where(
                 models.Appointment.date > datetime.fromtimestamp(after)
             )
         if utils.is_set(paid):
-            appointments = appointments.filter(
-                models.Appointment.paid == ("t" if paid else "f")
+            appointments = appointments.where(models.Appointment.paid == paid)
+        if utils.is_set(cursor):
+            appointments = after_cursor(appointments, cursor)
+
+    if stream:
+        return StreamingResponse(
+            stream_rows(db, appointments), media_type="application/x-ndjson"
+        )
+
+    response = await fetch_page(db, appointments, limit)
+    return await utils.cache_response(slot, response, tag)
+
+
+@router.get("/search", status_code=status.HTTP_200_OK)
+async def search_appointments(
+    request: Request,
+    start: int,
+    end: int,
+    paid: bool = None,
+    min_price: float = None,
+    max_price: float = None,
+    limit: int = Query(
+        settings.appointment_page_size, ge=1, le=settings.appointment_page_size_max
+    ),
+    cursor: str = None,
+    db: AsyncSession = Depends(oauth2.get_read_db),
+    auth_token: tokens.TokenClaims = Depends(oauth2.get_current_client),
+):
+    """
+    Lists appointments of every client between the start and end dates
+    (inclusive), with the client's name and address for scheduling
+    """
+    if auth_token.testing != "True":
+        await oauth2.validate_access_token(
+            request.client.host, request.client.port, auth_token
+        )
+    # Admin access
+    if auth_token.client_id != "0":
+        raise HTTPException(status.HTTP_403_FORBIDDEN)
+
+    appointments = (
+        select(
+            *APPOINTMENT_COLUMNS,
+            models.Appointment.client_id,
+            models.Client.name.label("client_name"),
+            models.Client.address.label("client_address"),
+        )
+        .join(models.Client, models.Appointment.client_id == models.Client.id)
+        .where(models.Appointment.date >= datetime.fromtimestamp(start).date())
+        .where(models.Appointment.date <= datetime.fromtimestamp(end).date())
+        .order_by(models.Appointment.date, models.Appointment.id)
+    )
+    if utils.is_set(paid):
+        # Spelled as a boolean expression so the partial index on unpaid rows
+        # matches even when the statement is prepared
+        appointments = appointments.where(
+            models.Appointment.paid if paid else ~models.Appointment.paid
+        )
+    if utils.is_set(min_price):
+        appointments = appointments.where(models.Appointment.price >= min_price)
+    if utils.is_set(max_price):
+        appointments = appointments.where(models.Appointment.price <= max_price)
+    if utils.is_set(cursor):
+        appointments = after_cursor(appointments, cursor)
+
+    return await fetch_page(db, appointments, limit)
+
+
+@router.get("/events", status_code=status.HTTP_200_OK)
+async def appointment_events(
+    request: Request,
+    client_id: int = None,
+    db: AsyncSession = Depends(database.get_db),
+    auth_token: tokens.TokenClaims = Depends(oauth2.get_current_client),
+):
+    """
+    Streams server-sent events as the client's appointments are created,
+    cancelled or paid; admins get every client's, or client_id's, events.
+    Events fan out from the worker's one LISTEN connection, so an open
+    stream costs no database connection.
+    """
+    if auth_token.testing != "True":
+        await oauth2.validate_access_token(
+            request.client.host, request.client.port, auth_token
+        )
+    if auth_token.client_id != "0":
+        if utils.is_set(client_id):
+            raise HTTPException(
+                status.HTTP_403_FORBIDDEN,
+                "Cannot get events from client of different id",
             )
+        client_id = int(auth_token.client_id)
+    if not settings.appointment_events:
+        raise HTTPException(
+            status.HTTP_404_NOT_FOUND, "Appointment events are disabled"
+        )
+
+    # The client existence check may have used the session; dependencies are
+    # only closed once the response ends, so its connection goes back now
+    await db.close()
 
-    return appointments.all()
+    # Streams end before the token expires, and regularly anyway since open
+    # responses hold up server shutdown; browsers reconnect on their own
+    until = time.time() + settings.appointment_events_max_seconds
+    if auth_token.exp is not None:
+        until = min(until, auth_token.exp)
+    return StreamingResponse(
+        events.broker.stream(
+            client_id, settings.appointment_events_heartbeat_seconds, until
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def after_cursor(statement, cursor: str):
+    """
+    Restricts a statement ordered by (date, id) to the rows after the cursor
+    """
+    try:
+        last_date, last_id = utils.decode_cursor(cursor)
+        last_date, last_id = date.fromisoformat(last_date), int(last_id)
+    except ValueError:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid cursor")
+    return statement.where(
+        tuple_(models.Appointment.date, models.Appointment.id)
+        > tuple_(last_date, last_id)
+    )
+
+
+async def fetch_page(db: AsyncSession, statement, limit: int) -> ORJSONResponse:
+    """
+    Runs a statement ordered by (date, id) and serializes at most limit rows
+    straight to JSON, setting X-Next-Cursor when more remain. The rows skip
+    per-row model validation and jsonable_encoder, so the statement must only
+    select public columns.
+    """
+    rows = (await db.execute(statement.limit(limit + 1))).all()
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = utils.encode_cursor(rows[-1].date, rows[-1].id)
+    return ORJSONResponse([row._asdict() for row in rows], headers=headers)
+
+
+async def stream_rows(db: AsyncSession, statement):
+    """
+    Yields the statement's rows as NDJSON, fetching them through a server-side
+    cursor so memory use does not grow with the result size
+    """
+    result = await db.stream(
+        statement.execution_options(yield_per=settings.stream_batch_size)
+    )
+    async for rows in result.partitions(settings.stream_batch_size):
+        with timed("serialization"):
+            lines = b"".join(orjson.dumps(row._asdict()) + b"\n" for row in rows)
+        yield lines
 
 
 @router.post(
     "", status_code=status.HTTP_201_CREATED, response_model=schemas.GETAppointmentReturn
 )
-def make_appointment(
+async def make_appointment(
     request: Request,
     appointment_data: schemas.POSTAppointmentInput,
-    db: Session = Depends(get_db),
-    auth_token: schemas.TokenData = Depends(oauth2.verify_access_token),
+    db: AsyncSession = Depends(get_db),
+    auth_token: tokens.TokenClaims = Depends(oauth2.get_current_client),
 ):
     if auth_token.testing != "True":
-        oauth2.validate_access_token(request.host, request.port, auth_token)
+        await oauth2.validate_access_token(
+            request.client.host, request.client.port, auth_token
+        )
     # Admin access
     if auth_token.client_id != "0":
         raise HTTPException(status.HTTP_403_FORBIDDEN)
 
-    # TODO: add email notification
     _data = appointment_data.dict()
 
-    client = (
-        db.query(models.Client)
-        .filter(models.Client.id == appointment_data.client_id)
-        .first()
-    )
-    if not client:
+    check_appointment(appointment_data)
+    if appointment_data.paid is None:
+        _data["paid"] = False
+
+    _data["date"] = datetime.fromtimestamp(_data["date"]).date()
+
+    # The unique (client_id, date) constraint and the client foreign key
+    # replace the lookups that used to precede the insert
+    try:
+        appointment = (
+            await db.execute(
+                insert(models.Appointment)
+                .values(**_data)
+                .on_conflict_do_nothing(index_elements=["client_id", "date"])
+                .returning(*APPOINTMENT_COLUMNS)
+            )
+        ).first()
+    except IntegrityError:
+        await db.rollback()
         raise HTTPException(
             status.HTTP_404_NOT_FOUND,
             f"Client with id: {appointment_data.client_id} does not exists",
         )
+    if not appointment:
+        await db.rollback()
+        raise HTTPException(
+            status.HTTP_409_CONFLICT, "Appointment already exists for client"
+        )
+    await outbox.notify_clients(
+        db,
+        outbox.APPOINTMENTS_BOOKED,
+        {appointment_data.client_id: {"dates": [appointment.date]}},
+    )
+    database.replicas.mark_written(appointment_data.client_id)
+    await db.commit()
+    return appointment._asdict()
+
+
+@router.post(
+    "/bulk",
+    status_code=status.HTTP_200_OK,
+    response_model=List[schemas.POSTAppointmentBulkResult],
+)
+async def make_appointments(
+    request: Request,
+    bulk_data: schemas.POSTAppointmentBulkInput,
+    db: AsyncSession = Depends(get_db),
+    auth_token: tokens.TokenClaims = Depends(oauth2.get_current_client),
+):
+    """
+    Creates a batch of appointments, given individually or as weekly
+    recurrences, in one transaction. Every appointment gets its own result:
+    created, conflict (the client already has an appointment that day) or
+    invalid.
+    """
+    if auth_token.testing != "True":
+        await oauth2.validate_access_token(
+            request.client.host, request.client.port, auth_token
+        )
+    # Admin access
+    if auth_token.client_id != "0":
+        raise HTTPException(status.HTTP_403_FORBIDDEN)
+
+    batch = list(bulk_data.appointments)
+    for recurrence in bulk_data.recurrences:
+        batch += expand_recurrence(recurrence)
+    if len(batch) > settings.appointment_bulk_size_max:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            f"Cannot create more than {settings.appointment_bulk_size_max} appointments at once",
+        )
+
+    results = []
+    pending = {}
+    for appointment_data in batch:
+        _data = appointment_data.dict()
+        _data["date"] = datetime.fromtimestamp(_data["date"]).date()
+        if _data["paid"] is None:
+            _data["paid"] = False
+        result = {"client_id": _data["client_id"], "date": _data["date"]}
+        results.append(result)
+        try:
+            check_appointment(appointment_data)
+        except HTTPException as error:
+            result.update(status="invalid", detail=error.detail)
+            continue
+        key = (_data["client_id"], _data["date"])
+        if key in pending:
+            result.update(status="conflict", detail="Duplicate appointment in batch")
+            continue
+        pending[key] = _data
+
+    if pending:
+        client_ids = {client_id for client_id, _ in pending}
+        existing_clients = set(
+            (
+                await db.execute(
+                    select(models.Client.id).where(models.Client.id.in_(client_ids))
+                )
+            ).scalars()
+        )
+        for result in results:
+            key = (result["client_id"], result["date"])
+            if "status" in result or key not in pending:
+                continue
+            if result["client_id"] not in existing_clients:
+                result.update(
+                    status="invalid",
+                    detail=f"Client with id: {result['client_id']} does not exists",
+                )
+                del pending[key]
+
+    created = {}
+    if pending:
+        inserted = await db.execute(
+            insert(models.Appointment)
+            .values(list(pending.values()))
+            .on_conflict_do_nothing(index_elements=["client_id", "date"])
+            .returning(
+                models.Appointment.id,
+                models.Appointment.client_id,
+                models.Appointment.date,
+            )
+        )
+        created = {(row.client_id, row.date): row.id for row in inserted}
+        # One notification per client, listing all of their new dates
+        booked = {}
+        for client_id, day in sorted(created):
+            booked.setdefault(client_id, {"dates": []})["dates"].append(day)
+        await outbox.notify_clients(db, outbox.APPOINTMENTS_BOOKED, booked)
+        written = set(booked)
+        for client_id in written:
+            database.replicas.mark_written(client_id)
+        await db.commit()
+
+    for result in results:
+        if "status" in result:
+            continue
+        key = (result["client_id"], result["date"])
+        if key in created:
+            result.update(status="created", id=created[key])
+        else:
+            result.update(
+                status="conflict", detail="Appointment already exists for client"
+            )
+    return results
+
+
+def check_appointment(appointment_data: schemas.POSTAppointmentInput):
     if (
         appointment_data.date
         < datetime.now().timestamp() + timedelta(days=1).total_seconds()
@@ -109,58 +451,98 @@ def make_appointment(
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Must provide description")
     if not appointment_data.price:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Must provide price")
-    if appointment_data.paid is None:
-        _data["paid"] = False
 
-    _data["date"] = datetime.fromtimestamp(_data["date"]).date()
 
-    appointment = (
-        db.query(models.Appointment)
-        .filter(models.Appointment.client_id == appointment_data.client_id)
-        .filter(models.Appointment.date == _data["date"])
-        .first()
-    )
-    if appointment:
-        raise HTTPException(
-            status.HTTP_409_CONFLICT, "Appointment already exists for client"
+def expand_recurrence(
+    recurrence: schemas.POSTAppointmentRecurrence,
+) -> List[schemas.POSTAppointmentInput]:
+    start = datetime.fromtimestamp(recurrence.start)
+    end = datetime.fromtimestamp(recurrence.end)
+    day = start + timedelta(days=(recurrence.weekday - start.weekday()) % 7)
+    appointments = []
+    while day <= end:
+        appointments.append(
+            schemas.POSTAppointmentInput(
+                client_id=recurrence.client_id,
+                description=recurrence.description,
+                price=recurrence.price,
+                paid=recurrence.paid,
+                date=int(day.timestamp()),
+            )
         )
-
-    appointment = models.Appointment(**_data)
-    db.add(appointment)
-    db.commit()
-    return _data
+        if len(appointments) > settings.appointment_bulk_size_max:
+            break
+        day += timedelta(weeks=recurrence.interval_weeks)
+    return appointments
 
 
 @router.delete("", status_code=status.HTTP_200_OK)
-def cancel_appointment(
+async def cancel_appointment(
     request: Request,
     id: int,
-    db: Session = Depends(get_db),
-    auth_token: schemas.TokenData = Depends(oauth2.verify_access_token),
+    db: AsyncSession = Depends(get_db),
+    auth_token: tokens.TokenClaims = Depends(oauth2.get_current_client),
 ):
     if auth_token.testing != "True":
-        oauth2.validate_access_token(request.host, request.port, auth_token)
-    client = (
-        db.query(models.Client).filter(models.Client.id == auth_token.client_id).first()
-    )
-    if not client:
-        raise HTTPException(
-            status.HTTP_404_NOT_FOUND,
-            f"Client with id: {auth_token.client_id} does not exists",
+        await oauth2.validate_access_token(
+            request.client.host, request.client.port, auth_token
         )
-    appointment = (
-        db.query(models.Appointment)
-        .filter(models.Appointment.client_id == auth_token.id)
-        .filter(models.Appointment.id == id)
+    # Scoping the delete to the caller covers a client that no longer exists
+    cancelled = await db.scalar(
+        delete(models.Appointment)
+        .where(models.Appointment.client_id == int(auth_token.client_id))
+        .where(models.Appointment.id == id)
+        .returning(models.Appointment.date)
     )
-    if appointment.first():
-        # TODO: add email notification
-        appointment.delete(synchronize_session=False)
-        db.commit()
-    else:
+    if not cancelled:
         raise HTTPException(
             status.HTTP_404_NOT_FOUND,
             f"Appointment with id: {id} does not exist for client",
         )
+    await outbox.notify_clients(
+        db,
+        outbox.APPOINTMENTS_CANCELLED,
+        {int(auth_token.client_id): {"dates": [cancelled]}},
+    )
+    database.replicas.mark_written(auth_token.client_id)
+    await db.commit()
 
     return Response(status_code=status.HTTP_200_OK)
+
+
+@router.delete("/bulk", status_code=status.HTTP_200_OK, response_model=List[int])
+async def cancel_appointments(
+    request: Request,
+    id: List[int] = Query(...),
+    db: AsyncSession = Depends(get_db),
+    auth_token: tokens.TokenClaims = Depends(oauth2.get_current_client),
+):
+    """
+    Cancels every listed appointment that belongs to the client in one
+    statement, returning the ids that were cancelled
+    """
+    if auth_token.testing != "True":
+        await oauth2.validate_access_token(
+            request.client.host, request.client.port, auth_token
+        )
+    cancelled = (
+        await db.execute(
+            delete(models.Appointment)
+            .where(models.Appointment.client_id == int(auth_token.client_id))
+            .where(models.Appointment.id.in_(id))
+            .returning(models.Appointment.id, models.Appointment.date)
+        )
+    ).all()
+    if cancelled:
+        await outbox.notify_clients(
+            db,
+            outbox.APPOINTMENTS_CANCELLED,
+            {
+                int(auth_token.client_id): {
+                    "dates": sorted(row.date for row in cancelled)
+                }
+            },
+        )
+        database.replicas.mark_written(auth_token.client_id)
+    await db.commit()
+    return [row.id for row in cancelled]
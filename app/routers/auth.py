@@ -1,7 +1,8 @@
 from fastapi import Depends, HTTPException, status, Request, APIRouter
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from .. import models, schemas, utils, oauth2
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models, schemas, tokens, utils, oauth2
 from ..config import settings
 from ..database import get_db
 
@@ -11,38 +12,47 @@ router = APIRouter(prefix="/auth", tags=["Authentication"])
 @router.post(
     "/login", status_code=status.HTTP_202_ACCEPTED, response_model=schemas.Token
 )
-def login_client(
+async def login_client(
     request: Request,
     credentials: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
 
-    if credentials.username == settings.admin_username and utils.verify(
+    if credentials.username == settings.admin_username and await utils.verify_async(
         credentials.password, settings.admin_password
     ):
-        access_token = oauth2.create_access_token(
-            {
-                "client_id": 0,
-                "host": utils.hash(request.client.host, request.client.port),
-            }
-        )
+        client_id = 0
     else:
-        client: models.Client = (
-            db.query(models.Client)
-            .filter(models.Client.email == credentials.username)
-            .first()
-        )
+        client = (
+            await db.execute(
+                select(models.Client.id, models.Client.password).where(
+                    models.Client.email == credentials.username
+                )
+            )
+        ).first()
 
         if not client:
             raise HTTPException(status.HTTP_403_FORBIDDEN, "Invalid Credentials")
 
-        if not utils.verify(credentials.password, client.password):
+        if not await utils.verify_async(credentials.password, client.password):
             raise HTTPException(status.HTTP_403_FORBIDDEN, "Invalid Credentials")
 
-        access_token = oauth2.create_access_token(
-            {
-                "client_id": client.id,
-                "host": utils.hash(request.client.host, request.client.port),
-            }
-        )
+        client_id = client.id
+
+    access_token = oauth2.create_access_token(
+        {
+            "client_id": client_id,
+            "host": await utils.hash_async(request.client.host, request.client.port),
+            "host_sig": utils.sign(request.client.host, request.client.port),
+        }
+    )
     return {"access_token": access_token, "token_type": "bearer"}
+
+
+@router.get("/keys", status_code=status.HTTP_200_OK)
+def get_keys():
+    """
+    Public keys that verify access tokens, as a JWK set, so other services
+    can check tokens without the secret; empty with the HMAC algorithms
+    """
+    return tokens.keyring.jwks()
@@ -1,44 +1,63 @@
 from fastapi import Depends, HTTPException, status, Response, APIRouter, Request
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import oauth2
-from .. import models, schemas, utils
+from .. import database, models, outbox, schemas, tokens, utils
+from ..cache import response_cache
 from ..database import get_db
+from ..responses import ORJSONResponse
 
 router = APIRouter(prefix="/client", tags=["Client"])
 
+# Columns of ClientPublic; the password hash never leaves the database on reads
+CLIENT_COLUMNS = (
+    models.Client.name,
+    models.Client.email,
+    models.Client.phone_number,
+    models.Client.address,
+)
+
 
 @router.post("", status_code=status.HTTP_201_CREATED)
-def create_client(client: schemas.POSTClientInput, db: Session = Depends(get_db)):
+async def create_client(
+    client: schemas.POSTClientInput, db: AsyncSession = Depends(get_db)
+):
     """
     Adds a new client to the database if the email address is not already registered
     """
     # TODO: Sanitize data
-    client_exists = (
-        db.query(models.Client).filter(models.Client.email == client.email).first()
+    client_exists = await db.scalar(
+        select(models.Client.id).where(models.Client.email == client.email)
     )
     if client_exists:
         raise HTTPException(status.HTTP_409_CONFLICT, "Email address in use")
 
-    client.password = utils.hash(client.password)
-    new_client = models.Client(**client.dict())
-    db.add(new_client)
-    db.commit()
+    client.password = await utils.hash_async(client.password)
+    client_id = await db.scalar(
+        insert(models.Client).values(**client.dict()).returning(models.Client.id)
+    )
+    await oauth2.client_changed(db, client_id)
+    database.replicas.mark_written(client_id)
+    await db.commit()
+    oauth2.forget_client(client_id)
     return Response(status_code=status.HTTP_201_CREATED)
 
 
 @router.get("", response_model=schemas.GETClientReturn)
-def get_client(
+async def get_client(
     request: Request,
     id: int = None,
-    db: Session = Depends(get_db),
-    auth_token: schemas.TokenData = Depends(oauth2.verify_access_token),
+    db: AsyncSession = Depends(oauth2.get_read_db),
+    auth_token: tokens.TokenClaims = Depends(oauth2.get_current_client),
 ):
     """
     Gets the  'public' information
     """
     if auth_token.testing != "True":
-        oauth2.validate_access_token(request.host, request.port, auth_token)
+        await oauth2.validate_access_token(
+            request.client.host, request.client.port, auth_token
+        )
     if auth_token.client_id != "0":
         if not (id is None):
             raise HTTPException(status.HTTP_403_FORBIDDEN)
@@ -48,26 +67,46 @@ def get_client(
             status.HTTP_400_BAD_REQUEST, "Need to specify client to get"
         )
 
-    client = db.query(models.Client).filter(models.Client.id == id).first()
+    # Cached responses are looked up by version, so a write committed by any
+    # process is never answered from the cache
+    version = await db.scalar(
+        select(models.Client.version).where(models.Client.id == id)
+    )
+    if version is None:
+        raise HTTPException(
+            status.HTTP_404_NOT_FOUND, f"Client with id: {id} does not exist"
+        )
+    tag = utils.etag("client", id, version)
+    if utils.etag_matches(request.headers.get("If-None-Match"), tag):
+        return utils.not_modified(tag)
+    cached, slot = await response_cache.get(id, version, "client")
+    if cached:
+        return utils.from_cache(cached, request.headers.get("If-None-Match"))
+
+    client = (
+        await db.execute(select(*CLIENT_COLUMNS).where(models.Client.id == id))
+    ).first()
     if not client:
         raise HTTPException(
             status.HTTP_404_NOT_FOUND, f"Client with id: {id} does not exist"
         )
-    return client
+    return await utils.cache_response(slot, ORJSONResponse(client._asdict()), tag)
 
 
 @router.delete("", status_code=status.HTTP_200_OK)
-def delete_client(
+async def delete_client(
     request: Request,
     id: int = None,
-    db: Session = Depends(get_db),
-    auth_token: schemas.TokenData = Depends(oauth2.verify_access_token),
+    db: AsyncSession = Depends(get_db),
+    auth_token: tokens.TokenClaims = Depends(oauth2.get_current_client),
 ):
     """
     Removes the client from the database
     """
     if auth_token.testing != "True":
-        oauth2.validate_access_token(request.host, request.port, auth_token)
+        await oauth2.validate_access_token(
+            request.client.host, request.client.port, auth_token
+        )
     if auth_token.client_id != "0":
         if not (id is None):
             raise HTTPException(
@@ -78,13 +117,23 @@ def delete_client(
         raise HTTPException(
             status.HTTP_400_BAD_REQUEST, "Need to specify client to delete"
         )
-    client_query = db.query(models.Client).filter(models.Client.id == id)
-    if not client_query.first():
+    deleted = (
+        await db.execute(
+            delete(models.Client)
+            .where(models.Client.id == id)
+            .returning(models.Client.email, models.Client.name)
+        )
+    ).first()
+    if not deleted:
         raise HTTPException(
             status.HTTP_404_NOT_FOUND, f"Client with id: {id} does not exist"
         )
 
-    # TODO: add email notification
-    client_query.delete(synchronize_session=False)
-    db.commit()
+    await db.execute(
+        outbox.notification(outbox.CLIENT_DELETED, deleted.email, name=deleted.name)
+    )
+    await oauth2.client_changed(db, id)
+    database.replicas.mark_written(id)
+    await db.commit()
+    oauth2.forget_client(id)
     return Response(status_code=status.HTTP_200_OK)
@@ -0,0 +1,71 @@
+from fastapi import Depends, HTTPException, status, APIRouter, Request
+from app import oauth2
+from .. import tokens
+from ..cache import response_cache
+from ..database import pool_metrics
+from ..metrics import request_metrics
+
+router = APIRouter(prefix="/debug", tags=["Debug"])
+
+
+@router.get("/pool", status_code=status.HTTP_200_OK)
+async def get_pool_stats(
+    request: Request,
+    auth_token: tokens.TokenClaims = Depends(oauth2.get_current_client),
+):
+    """
+    Reports connection pool usage for every engine the process has created
+    """
+    if auth_token.testing != "True":
+        await oauth2.validate_access_token(
+            request.client.host, request.client.port, auth_token
+        )
+    # Admin access
+    if auth_token.client_id != "0":
+        raise HTTPException(status.HTTP_403_FORBIDDEN)
+
+    return {name: metrics.snapshot() for name, metrics in pool_metrics.items()}
+
+
+@router.get("/cache", status_code=status.HTTP_200_OK)
+async def get_cache_stats(
+    request: Request,
+    auth_token: tokens.TokenClaims = Depends(oauth2.get_current_client),
+):
+    """
+    Reports size and hit ratio of the in-process and response caches
+    """
+    if auth_token.testing != "True":
+        await oauth2.validate_access_token(
+            request.client.host, request.client.port, auth_token
+        )
+    # Admin access
+    if auth_token.client_id != "0":
+        raise HTTPException(status.HTTP_403_FORBIDDEN)
+
+    return {
+        "token": oauth2.token_cache.stats(),
+        "claims": oauth2.claims_cache.stats(),
+        "client": oauth2.client_cache.stats(),
+        "response": response_cache.stats(),
+    }
+
+
+@router.get("/requests", status_code=status.HTTP_200_OK)
+async def get_request_stats(
+    request: Request,
+    auth_token: tokens.TokenClaims = Depends(oauth2.get_current_client),
+):
+    """
+    Reports latency percentiles, status codes and time spent in the database,
+    hashing and serialization for every route
+    """
+    if auth_token.testing != "True":
+        await oauth2.validate_access_token(
+            request.client.host, request.client.port, auth_token
+        )
+    # Admin access
+    if auth_token.client_id != "0":
+        raise HTTPException(status.HTTP_403_FORBIDDEN)
+
+    return request_metrics.snapshot()
@@ -0,0 +1,122 @@
+import csv
+import io
+from datetime import datetime
+from fastapi import Depends, HTTPException, status, APIRouter, Request, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import oauth2
+from .. import models, tokens, utils
+from ..config import settings
+from ..metrics import timed
+from .appointment import stream_rows
+
+router = APIRouter(prefix="/export", tags=["Export"])
+
+EXPORT_FORMAT = Query("ndjson", regex="^(csv|ndjson)$")
+
+
+@router.get("/appointments", status_code=status.HTTP_200_OK)
+async def export_appointments(
+    request: Request,
+    start: int = None,
+    end: int = None,
+    paid: bool = None,
+    format: str = EXPORT_FORMAT,
+    db: AsyncSession = Depends(oauth2.get_read_db),
+    auth_token: tokens.TokenClaims = Depends(oauth2.get_current_client),
+):
+    """
+    Streams every appointment between the start and end dates (inclusive),
+    with the client's name and email, as CSV or NDJSON
+    """
+    await require_admin(request, auth_token)
+
+    appointments = (
+        select(
+            models.Appointment.id,
+            models.Appointment.date,
+            models.Appointment.client_id,
+            models.Client.name.label("client_name"),
+            models.Client.email.label("client_email"),
+            models.Appointment.description,
+            models.Appointment.price,
+            models.Appointment.paid,
+        )
+        .join(models.Client, models.Appointment.client_id == models.Client.id)
+        .order_by(models.Appointment.date, models.Appointment.id)
+    )
+    if utils.is_set(start):
+        appointments = appointments.where(
+            models.Appointment.date >= datetime.fromtimestamp(start).date()
+        )
+    if utils.is_set(end):
+        appointments = appointments.where(
+            models.Appointment.date <= datetime.fromtimestamp(end).date()
+        )
+    if utils.is_set(paid):
+        appointments = appointments.where(
+            models.Appointment.paid if paid else ~models.Appointment.paid
+        )
+    return export(db, appointments, format, "appointments")
+
+
+@router.get("/clients", status_code=status.HTTP_200_OK)
+async def export_clients(
+    request: Request,
+    format: str = EXPORT_FORMAT,
+    db: AsyncSession = Depends(oauth2.get_read_db),
+    auth_token: tokens.TokenClaims = Depends(oauth2.get_current_client),
+):
+    """
+    Streams every client's public information as CSV or NDJSON
+    """
+    await require_admin(request, auth_token)
+
+    clients = select(
+        models.Client.id,
+        models.Client.date_joined,
+        models.Client.name,
+        models.Client.email,
+        models.Client.phone_number,
+        models.Client.address,
+    ).order_by(models.Client.id)
+    return export(db, clients, format, "clients")
+
+
+async def require_admin(request: Request, auth_token: tokens.TokenClaims):
+    if auth_token.testing != "True":
+        await oauth2.validate_access_token(
+            request.client.host, request.client.port, auth_token
+        )
+    # Admin access
+    if auth_token.client_id != "0":
+        raise HTTPException(status.HTTP_403_FORBIDDEN)
+
+
+def export(db: AsyncSession, statement, format: str, name: str):
+    """
+    Streams the statement's rows through a server-side cursor, one batch at
+    a time, so memory use stays flat and the first bytes go out right away
+    """
+    if format == "csv":
+        body, media_type = stream_csv(db, statement), "text/csv"
+    else:
+        body, media_type = stream_rows(db, statement), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{name}.{format}"'},
+    )
+
+
+async def stream_csv(db: AsyncSession, statement):
+    yield ",".join(column.name for column in statement.selected_columns) + "\r\n"
+    result = await db.stream(
+        statement.execution_options(yield_per=settings.stream_batch_size)
+    )
+    async for rows in result.partitions(settings.stream_batch_size):
+        with timed("serialization"):
+            lines = io.StringIO()
+            csv.writer(lines).writerows(rows)
+        yield lines.getvalue()
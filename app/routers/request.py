@@ -0,0 +1,75 @@
+from datetime import datetime
+from fastapi import Depends, HTTPException, status, Response, APIRouter, Request, Query
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import oauth2
+from .. import models, schemas, tokens, utils
+from ..config import settings
+from ..intake import buffer
+from ..responses import ORJSONResponse
+
+router = APIRouter(prefix="/request", tags=["Request"])
+
+REQUEST_COLUMNS = (
+    models.Request.id,
+    models.Request.date_made,
+    models.Request.email,
+    models.Request.description,
+    models.Request.client_id,
+)
+
+
+@router.post("", status_code=status.HTTP_202_ACCEPTED)
+async def make_request(request_data: schemas.POSTRequestInput):
+    """
+    Accepts a quote request from the website form; it is written to the
+    database with the next batch
+    """
+    buffer.submit(request_data.email, request_data.description)
+    return Response(status_code=status.HTTP_202_ACCEPTED)
+
+
+@router.get("", status_code=status.HTTP_200_OK)
+async def get_requests(
+    request: Request,
+    limit: int = Query(
+        settings.appointment_page_size, ge=1, le=settings.appointment_page_size_max
+    ),
+    cursor: str = None,
+    db: AsyncSession = Depends(oauth2.get_read_db),
+    auth_token: tokens.TokenClaims = Depends(oauth2.get_current_client),
+):
+    """
+    Lists service requests for triage, oldest first
+    """
+    if auth_token.testing != "True":
+        await oauth2.validate_access_token(
+            request.client.host, request.client.port, auth_token
+        )
+    # Admin access
+    if auth_token.client_id != "0":
+        raise HTTPException(status.HTTP_403_FORBIDDEN)
+
+    requests = select(*REQUEST_COLUMNS).order_by(
+        models.Request.date_made, models.Request.id
+    )
+    if utils.is_set(cursor):
+        try:
+            last_date_made, last_id = utils.decode_cursor(cursor)
+            last_date_made = datetime.fromisoformat(last_date_made)
+            last_id = int(last_id)
+        except ValueError:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid cursor")
+        requests = requests.where(
+            tuple_(models.Request.date_made, models.Request.id)
+            > tuple_(last_date_made, last_id)
+        )
+
+    rows = (await db.execute(requests.limit(limit + 1))).all()
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = utils.encode_cursor(
+            rows[-1].date_made.isoformat(), rows[-1].id
+        )
+    return ORJSONResponse([row._asdict() for row in rows], headers=headers)
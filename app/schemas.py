@@ -1,5 +1,6 @@
-from pydantic import BaseModel, EmailStr, constr
-from typing import Optional
+from pydantic import BaseModel, EmailStr, conint, constr
+from typing import List, Optional
+from datetime import date
 
 PASSWORD_CONSTRAINT = constr(min_length=8)
 
@@ -39,9 +40,42 @@ class POSTAppointmentInput(AppointmentPublic):
     client_id: int
 
 
+class ImportAppointment(AppointmentPublic):
+    client_email: EmailStr
+    date: date
+    paid: bool = False
+
+
+class POSTAppointmentRecurrence(AppointmentPublic):
+    """
+    Every `interval_weeks` weeks on `weekday` (Monday is 0) from `start` to
+    `end`, both inclusive
+    """
+
+    client_id: int
+    paid: Optional[bool] = False
+    weekday: conint(ge=0, le=6)
+    start: int
+    end: int
+    interval_weeks: conint(ge=1) = 1
+
+
+class POSTAppointmentBulkInput(BaseModel):
+    appointments: List[POSTAppointmentInput] = []
+    recurrences: List[POSTAppointmentRecurrence] = []
+
+
+class POSTAppointmentBulkResult(BaseModel):
+    client_id: int
+    date: date
+    status: str
+    id: Optional[int] = None
+    detail: Optional[str] = None
+
+
 class GETAppointmentReturn(AppointmentPublic):
     id: int
-    date: str
+    date: date
     paid: bool
 
     class Config:
@@ -56,4 +90,11 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     client_id: str
     host: str
+    host_sig: Optional[str] = None
+    exp: Optional[int] = None
     testing: str = "False"
+
+
+class POSTRequestInput(BaseModel):
+    email: EmailStr
+    description: constr(strip_whitespace=True, min_length=1, max_length=4000)
@@ -0,0 +1,355 @@
+"""
+Access token signing and verification.
+
+Signing keys are parsed once, when the module loads. The native backend
+verifies compact JWS tokens with the stdlib (HS256/384/512) or cryptography
+(RS256, ES256, EdDSA) and decodes the claims with orjson into an immutable
+TokenClaims; the jose backend keeps python-jose for comparison. Tokens carry
+the signing key's id in their `kid` header, so keys can be rotated: the new
+key signs while the previous ones stay in the verification keys until the
+tokens they signed expire.
+"""
+import base64
+import hashlib
+import hmac
+from time import time
+from typing import Dict, NamedTuple, Optional
+import orjson
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import (
+    decode_dss_signature,
+    encode_dss_signature,
+)
+from jose import JWTError, jwk, jwt
+from .config import settings
+
+
+class TokenError(Exception):
+    pass
+
+
+class TokenClaims(NamedTuple):
+    """
+    The claims the API issues, as plain attributes (the fields of
+    schemas.TokenData without its validation cost). Verified claims are
+    cached and shared by concurrent requests, so they cannot be changed.
+    """
+
+    client_id: str
+    host: str
+    host_sig: Optional[str] = None
+    exp: Optional[int] = None
+    testing: str = "False"
+
+    @classmethod
+    def from_claims(cls, claims: dict) -> "TokenClaims":
+        try:
+            return cls(
+                str(claims["client_id"]),
+                str(claims["host"]),
+                claims.get("host_sig"),
+                claims.get("exp"),
+                str(claims.get("testing", "False")),
+            )
+        except (KeyError, TypeError) as error:
+            raise TokenError("Missing claims") from error
+
+    def __repr__(self) -> str:
+        return f"TokenClaims(client_id={self.client_id!r}, exp={self.exp!r})"
+
+
+def b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def b64decode(data: bytes) -> bytes:
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+def b64_int(value: int) -> str:
+    return b64encode(value.to_bytes((value.bit_length() + 7) // 8, "big")).decode()
+
+
+class HMACKey:
+    DIGESTS = {
+        "HS256": hashlib.sha256,
+        "HS384": hashlib.sha384,
+        "HS512": hashlib.sha512,
+    }
+
+    def __init__(self, algorithm: str, secret: str):
+        self.algorithm = algorithm
+        self.digest = self.DIGESTS[algorithm]
+        self.secret = secret.encode()
+
+    def sign(self, data: bytes) -> bytes:
+        return hmac.new(self.secret, data, self.digest).digest()
+
+    def verify(self, data: bytes, signature: bytes) -> bool:
+        return hmac.compare_digest(self.sign(data), signature)
+
+    def jwk(self) -> Optional[dict]:
+        # Shared secrets are never published
+        return None
+
+
+class PublicKey:
+    """
+    Asymmetric key: verifies with the public key and, when the private key
+    was given, signs too
+    """
+
+    def __init__(self, algorithm: str, pem: str):
+        self.algorithm = algorithm
+        data = pem.encode()
+        if b"PRIVATE KEY" in data:
+            self.private_key = serialization.load_pem_private_key(data, None)
+            self.public_key = self.private_key.public_key()
+        else:
+            self.private_key = None
+            self.public_key = serialization.load_pem_public_key(data)
+        if not isinstance(self.public_key, self.KEY_TYPE):
+            raise ValueError(f"{algorithm} needs a {self.KEY_TYPE.__name__}")
+
+    def sign(self, data: bytes) -> bytes:
+        if self.private_key is None:
+            raise TokenError("Verification-only key cannot sign")
+        return self._sign(data)
+
+    def verify(self, data: bytes, signature: bytes) -> bool:
+        try:
+            self._verify(data, signature)
+        except (InvalidSignature, ValueError):
+            return False
+        return True
+
+
+class EdDSAKey(PublicKey):
+    KEY_TYPE = ed25519.Ed25519PublicKey
+
+    def _sign(self, data: bytes) -> bytes:
+        return self.private_key.sign(data)
+
+    def _verify(self, data: bytes, signature: bytes):
+        self.public_key.verify(signature, data)
+
+    def jwk(self) -> dict:
+        raw = self.public_key.public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw
+        )
+        return {"kty": "OKP", "crv": "Ed25519", "x": b64encode(raw).decode()}
+
+
+class ES256Key(PublicKey):
+    KEY_TYPE = ec.EllipticCurvePublicKey
+    SIZE = 32
+
+    def __init__(self, algorithm: str, pem: str):
+        super().__init__(algorithm, pem)
+        if not isinstance(self.public_key.curve, ec.SECP256R1):
+            raise ValueError("ES256 needs a P-256 key")
+
+    def _sign(self, data: bytes) -> bytes:
+        # JWS signatures are r || s, not the DER that cryptography produces
+        r, s = decode_dss_signature(
+            self.private_key.sign(data, ec.ECDSA(hashes.SHA256()))
+        )
+        return r.to_bytes(self.SIZE, "big") + s.to_bytes(self.SIZE, "big")
+
+    def _verify(self, data: bytes, signature: bytes):
+        if len(signature) != 2 * self.SIZE:
+            raise InvalidSignature()
+        r = int.from_bytes(signature[: self.SIZE], "big")
+        s = int.from_bytes(signature[self.SIZE :], "big")
+        self.public_key.verify(
+            encode_dss_signature(r, s), data, ec.ECDSA(hashes.SHA256())
+        )
+
+    def jwk(self) -> dict:
+        numbers = self.public_key.public_numbers()
+        return {
+            "kty": "EC",
+            "crv": "P-256",
+            "x": b64encode(numbers.x.to_bytes(self.SIZE, "big")).decode(),
+            "y": b64encode(numbers.y.to_bytes(self.SIZE, "big")).decode(),
+        }
+
+
+class RS256Key(PublicKey):
+    KEY_TYPE = rsa.RSAPublicKey
+
+    def _sign(self, data: bytes) -> bytes:
+        return self.private_key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+
+    def _verify(self, data: bytes, signature: bytes):
+        self.public_key.verify(signature, data, padding.PKCS1v15(), hashes.SHA256())
+
+    def jwk(self) -> dict:
+        numbers = self.public_key.public_numbers()
+        return {"kty": "RSA", "n": b64_int(numbers.n), "e": b64_int(numbers.e)}
+
+
+KEY_TYPES = {
+    **{algorithm: HMACKey for algorithm in HMACKey.DIGESTS},
+    "RS256": RS256Key,
+    "ES256": ES256Key,
+    "EdDSA": EdDSAKey,
+}
+
+
+def load_key(algorithm: str, material: str):
+    """
+    A secret for HS*, a PEM private (to sign) or public key otherwise
+    """
+    if algorithm not in KEY_TYPES:
+        raise ValueError(f"Unsupported token algorithm {algorithm}")
+    return KEY_TYPES[algorithm](algorithm, material)
+
+
+class Keyring:
+    """
+    The signing key and every key accepted for verification, by key id
+    """
+
+    def __init__(
+        self,
+        algorithm: str,
+        signing_key: str,
+        signing_kid: str = "",
+        verification_keys: Dict[str, str] = None,
+    ):
+        self.algorithm = algorithm
+        self.signing_kid = signing_kid
+        self.signing_key = load_key(algorithm, signing_key)
+        self.keys = {
+            kid: load_key(algorithm, material)
+            for kid, material in (verification_keys or {}).items()
+        }
+        self.keys[signing_kid] = self.signing_key
+        header = {"alg": algorithm, "typ": "JWT"}
+        if signing_kid:
+            header["kid"] = signing_kid
+        self.header = b64encode(orjson.dumps(header))
+
+    def sign(self, claims: dict) -> str:
+        signing_input = self.header + b"." + b64encode(orjson.dumps(claims))
+        signature = self.signing_key.sign(signing_input)
+        return (signing_input + b"." + b64encode(signature)).decode()
+
+    def jwks(self) -> dict:
+        keys = []
+        for kid, key in self.keys.items():
+            jwk = key.jwk()
+            if jwk is not None:
+                keys.append({**jwk, "kid": kid, "alg": self.algorithm, "use": "sig"})
+        return {"keys": keys}
+
+
+class NativeVerifier:
+    def __init__(self, keyring: Keyring, max_headers: int = 64):
+        self.keyring = keyring
+        self.max_headers = max_headers
+        # Encoded header -> key; every token of a key shares its header
+        self._headers = {}
+
+    def key(self, header: bytes):
+        key = self._headers.get(header)
+        if key is not None:
+            return key
+        try:
+            fields = orjson.loads(b64decode(header))
+        except (ValueError, orjson.JSONDecodeError) as error:
+            raise TokenError("Malformed header") from error
+        if not isinstance(fields, dict):
+            raise TokenError("Malformed header")
+        # Only the configured algorithm, so a public key is never used as an
+        # HMAC secret
+        if fields.get("alg") != self.keyring.algorithm:
+            raise TokenError("Unexpected algorithm")
+        key = self.keyring.keys.get(fields.get("kid", ""))
+        if key is None:
+            raise TokenError("Unknown key")
+        if len(self._headers) < self.max_headers:
+            self._headers[header] = key
+        return key
+
+    def verify(self, token: str) -> TokenClaims:
+        try:
+            signing_input, _, signature = token.encode("ascii").rpartition(b".")
+            header, _, payload = signing_input.partition(b".")
+            signature = b64decode(signature)
+        except (UnicodeEncodeError, ValueError) as error:
+            raise TokenError("Malformed token") from error
+        if not payload:
+            raise TokenError("Malformed token")
+        if not self.key(header).verify(signing_input, signature):
+            raise TokenError("Invalid signature")
+        try:
+            claims = orjson.loads(b64decode(payload))
+        except (ValueError, orjson.JSONDecodeError) as error:
+            raise TokenError("Malformed claims") from error
+        if not isinstance(claims, dict):
+            raise TokenError("Malformed claims")
+        now = time()
+        exp = claims.get("exp")
+        if exp is not None and (not isinstance(exp, (int, float)) or exp < now):
+            raise TokenError("Expired")
+        nbf = claims.get("nbf")
+        if nbf is not None and (not isinstance(nbf, (int, float)) or nbf > now):
+            raise TokenError("Not yet valid")
+        return TokenClaims.from_claims(claims)
+
+
+class JoseVerifier:
+    """
+    python-jose's decode, as before the native backend; no EdDSA
+    """
+
+    def __init__(self, keyring: Keyring):
+        self.keyring = keyring
+        if keyring.algorithm == "EdDSA":
+            raise RuntimeError("TOKEN_BACKEND=jose does not support EdDSA")
+        self.keys = {
+            kid: jwk.construct(self._material(key), keyring.algorithm)
+            for kid, key in keyring.keys.items()
+        }
+
+    @staticmethod
+    def _material(key):
+        if isinstance(key, HMACKey):
+            return key.secret
+        return key.public_key.public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+
+    def verify(self, token: str) -> TokenClaims:
+        try:
+            kid = jwt.get_unverified_header(token).get("kid", "")
+            key = self.keys.get(kid)
+            if key is None:
+                raise TokenError("Unknown key")
+            claims = jwt.decode(token, key, algorithms=[self.keyring.algorithm])
+        except JWTError as error:
+            raise TokenError(str(error)) from error
+        return TokenClaims.from_claims(claims)
+
+
+VERIFIERS = {"native": NativeVerifier, "jose": JoseVerifier}
+
+
+def make_verifier(keyring: Keyring, backend: str = "native"):
+    if backend not in VERIFIERS:
+        raise ValueError(f"Unknown token backend {backend}")
+    return VERIFIERS[backend](keyring)
+
+
+keyring = Keyring(
+    settings.token_algorithm,
+    settings.token_secret,
+    settings.token_key_id,
+    settings.token_verification_keys,
+)
+verifier = make_verifier(keyring, settings.token_backend)
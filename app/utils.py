@@ -1,6 +1,27 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+from fastapi import HTTPException, Response, status
 from passlib.context import CryptContext
+from .cache import CachedResponse, response_cache
+from .config import settings
+from .metrics import timed
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.bcrypt_rounds
+)
+
+# bcrypt releases the GIL, so a dedicated thread pool keeps hashing off
+# Starlette's threadpool without the overhead of a process pool
+hashing_executor = ThreadPoolExecutor(
+    max_workers=settings.hashing_workers, thread_name_prefix="hashing"
+)
+_hashing_slots = BoundedSemaphore(
+    settings.hashing_workers + settings.hashing_queue_depth
+)
 
 
 def hash(*args):
@@ -11,5 +32,110 @@ def verify(plain_password: str, hashed_password: str):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+async def _offload(function, *args):
+    if not _hashing_slots.acquire(blocking=False):
+        raise HTTPException(
+            status.HTTP_503_SERVICE_UNAVAILABLE,
+            "Server busy, try again later",
+            headers={"Retry-After": "1"},
+        )
+    future = hashing_executor.submit(function, *args)
+    future.add_done_callback(lambda _: _hashing_slots.release())
+    with timed("hashing"):
+        return await asyncio.wrap_future(future)
+
+
+async def hash_async(*args):
+    return await _offload(hash, *args)
+
+
+async def verify_async(plain_password: str, hashed_password: str):
+    return await _offload(verify, plain_password, hashed_password)
+
+
+def sign(*args):
+    """
+    Keyed HMAC of the arguments; a cheap alternative to `hash` for values
+    that only need to be bound to a token, not stored.
+    """
+    message = "-".join([str(arg) for arg in args]).encode()
+    return hmac.new(settings.token_secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify_signature(signature: str, *args):
+    return hmac.compare_digest(sign(*args), signature)
+
+
+def encode_cursor(*values):
+    """
+    Opaque keyset pagination cursor holding the sort key of the last row sent
+    """
+    raw = "|".join(str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        return base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    except ValueError:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid cursor")
+
+
+# Private data that clients may keep but must revalidate before every use
+CACHE_CONTROL = "private, no-cache"
+
+
+def etag(*parts):
+    """
+    Strong entity tag for a representation identified by the given parts
+    """
+    raw = "-".join(str(part) for part in parts).encode()
+    return f'"{hashlib.blake2b(raw, digest_size=12).hexdigest()}"'
+
+
+def etag_matches(if_none_match: str, tag: str):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (candidate.strip() for candidate in if_none_match.split(","))
+    return any(candidate.removeprefix("W/") == tag for candidate in candidates)
+
+
+def not_modified(tag: str):
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": tag, "Cache-Control": CACHE_CONTROL},
+    )
+
+
+def set_etag(response: Response, tag: str):
+    response.headers["ETag"] = tag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
+
+
+async def cache_response(slot: str, response: Response, tag: str = None):
+    """
+    Tags the response, if a tag is given, and stores it in the response cache
+    """
+    if tag:
+        set_etag(response, tag)
+    headers = {
+        name: value
+        for name, value in response.headers.items()
+        if name not in ("content-length", "content-type")
+    }
+    await response_cache.set(slot, response.body, headers)
+    return response
+
+
+def from_cache(cached: CachedResponse, if_none_match: str):
+    tag = cached.headers.get("etag")
+    if tag and etag_matches(if_none_match, tag):
+        return not_modified(tag)
+    return Response(cached.body, media_type="application/json", headers=cached.headers)
+
+
 def is_set(parameter):
     return not (parameter is None)
@@ -0,0 +1,51 @@
+"""
+Outbox worker process, sending the queued email notifications.
+
+    python -m app.worker
+
+Runs until SIGTERM or SIGINT; any number of workers can run side by side.
+"""
+import argparse
+import logging
+import signal
+import threading
+from .config import settings
+from .database import engine
+from .outbox import Mailer, OutboxWorker
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--once", action="store_true", help="send one batch and exit")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    worker = OutboxWorker(
+        engine,
+        Mailer(
+            settings.smtp_host,
+            settings.smtp_port,
+            settings.smtp_username,
+            settings.smtp_password,
+            settings.smtp_starttls,
+            settings.smtp_timeout,
+        ),
+        settings.outbox_batch_size,
+        settings.outbox_max_attempts,
+        settings.outbox_backoff_seconds,
+        settings.outbox_lease_seconds,
+    )
+    if args.once:
+        logger.info("%s", worker.drain_once())
+        worker.mailer.close()
+        return
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    worker.run(settings.outbox_poll_seconds, stopping)
+
+
+if __name__ == "__main__":
+    main()
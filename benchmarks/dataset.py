@@ -0,0 +1,146 @@
+"""
+Seeds a reproducible benchmark dataset into the configured database.
+
+    python -m benchmarks.dataset --clients 100000 --appointments 50 --seed 1
+
+Clients are generated with a seeded Faker and loaded with COPY; their emails
+are client<n>@bench.example and they all share PASSWORD. Appointments are
+generated by Postgres with generate_series, one a week per client around
+today, with the client version and event triggers disabled for the load. --reset
+removes a previous benchmark dataset first. The tables must already exist
+(alembic upgrade head).
+"""
+import argparse
+import io
+import json
+import sys
+import time
+
+from faker import Faker
+from sqlalchemy import text
+
+from app import utils
+from app.database import engine
+
+PASSWORD = "benchmark-password"
+EMAIL_DOMAIN = "bench.example"
+# Triggers that would otherwise bump the version of every seeded client and
+# notify every seeded appointment
+TRIGGERS = (
+    "appointments_bump_client_version_insert",
+    "appointments_bump_client_version_delete",
+    "appointments_notify_changed",
+)
+DESCRIPTIONS = ("Mowing", "Edging", "Leaf removal", "Hedge trimming", "Aeration")
+
+
+def email(index: int) -> str:
+    return f"client{index}@{EMAIL_DOMAIN}"
+
+
+def client_ids() -> range:
+    """
+    Ids of the seeded clients; COPY assigns them in email order
+    """
+    with engine.connect() as connection:
+        first, last = connection.execute(
+            text("SELECT min(id), max(id) FROM clients WHERE email LIKE :emails"),
+            {"emails": f"%@{EMAIL_DOMAIN}"},
+        ).one()
+    if first is None:
+        raise RuntimeError("No benchmark dataset, run python -m benchmarks.dataset")
+    return range(first, last + 1)
+
+
+def client_rows(count: int, seed: int) -> io.StringIO:
+    faker = Faker("en_US")
+    faker.seed_instance(seed)
+    password = utils.hash(PASSWORD)
+    rows = io.StringIO()
+    for index in range(count):
+        name = faker.name()
+        address = faker.street_address().replace("\n", " ")
+        phone_number = faker.numerify("###-###-####")
+        rows.write(f"{name}\t{email(index)}\t{phone_number}\t{password}\t{address}\n")
+    rows.seek(0)
+    return rows
+
+
+def set_triggers(cursor, enabled: bool):
+    for trigger in TRIGGERS:
+        action = "ENABLE" if enabled else "DISABLE"
+        cursor.execute(f"ALTER TABLE appointments {action} TRIGGER {trigger}")
+
+
+def reset(cursor):
+    set_triggers(cursor, False)
+    cursor.execute("DELETE FROM clients WHERE email LIKE %s", (f"%@{EMAIL_DOMAIN}",))
+    set_triggers(cursor, True)
+
+
+def load(cursor, clients: int, appointments: int, seed: int):
+    cursor.copy_expert(
+        "COPY clients (name, email, phone_number, password, address) FROM STDIN",
+        client_rows(clients, seed),
+    )
+    # random() is seeded so prices and payment status are reproducible too
+    cursor.execute("SELECT setseed(%s)", (1 / (seed + 1),))
+    set_triggers(cursor, False)
+    cursor.execute(
+        """
+        INSERT INTO appointments (client_id, date, description, price, paid)
+        SELECT
+            clients.id,
+            current_date + (week - %(appointments)s / 2) * 7,
+            (%(descriptions)s::text[])[1 + (clients.id + week) %% %(choices)s],
+            round((25 + random() * 100)::numeric, 2),
+            week < %(appointments)s / 2 AND random() < 0.9
+        FROM clients
+        CROSS JOIN generate_series(0, %(appointments)s - 1) AS week
+        WHERE clients.email LIKE %(emails)s
+        ORDER BY clients.id, week
+        """,
+        {
+            "appointments": appointments,
+            "descriptions": list(DESCRIPTIONS),
+            "choices": len(DESCRIPTIONS),
+            "emails": f"%@{EMAIL_DOMAIN}",
+        },
+    )
+    set_triggers(cursor, True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", type=int, default=100000)
+    parser.add_argument("--appointments", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--reset", action="store_true")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            if args.reset:
+                reset(cursor)
+            load(cursor, args.clients, args.appointments, args.seed)
+            # Fresh statistics so the first benchmark run gets the real plans
+            cursor.execute("ANALYZE clients")
+            cursor.execute("ANALYZE appointments")
+        connection.commit()
+    finally:
+        connection.close()
+
+    report = {
+        "clients": args.clients,
+        "appointments": args.clients * args.appointments,
+        "seed": args.seed,
+        "seconds": time.perf_counter() - start,
+    }
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Load benchmark comparing the sync (psycopg2 + threadpool) and async (asyncpg)
+database modes on the same endpoints.
+
+    python -m benchmarks.db_mode --concurrency 64 --duration 10
+
+Starts one uvicorn worker per mode against the configured database, seeds a
+client with appointments, then drives GET /client and GET /appointment from
+`concurrency` keep-alive connections. Results are printed as JSON.
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import requests
+from faker import Faker
+
+from app import models, utils
+from app.database import SessionLocal
+
+from .harness import start_server, stop_server, summarize
+
+PASSWORD = "benchmark-password"
+
+
+def seed(appointments: int) -> str:
+    faker = Faker()
+    db = SessionLocal()
+    try:
+        client = models.Client(
+            name=faker.name(),
+            email=faker.unique.email(),
+            phone_number="555-555-5555",
+            address=faker.street_address(),
+            password=utils.hash(PASSWORD),
+        )
+        db.add(client)
+        db.flush()
+        db.add_all(
+            models.Appointment(
+                client_id=client.id,
+                date=date.today() + timedelta(days=day),
+                description="Mowing",
+                price=45.0,
+            )
+            for day in range(appointments)
+        )
+        db.commit()
+        return client.email
+    finally:
+        db.close()
+
+
+def worker(base_url: str, email: str, paths: list, deadline: float) -> dict:
+    # Tokens are bound to the connection they were issued on, so every
+    # worker logs in over its own keep-alive session
+    http = requests.Session()
+    token = http.post(
+        f"{base_url}/auth/login", data={"username": email, "password": PASSWORD}
+    ).json()["access_token"]
+    http.headers["Authorization"] = f"Bearer {token}"
+    latencies = {path: [] for path in paths}
+    errors = 0
+    while time.perf_counter() < deadline:
+        for path in paths:
+            start = time.perf_counter()
+            response = http.get(f"{base_url}{path}")
+            latencies[path].append(time.perf_counter() - start)
+            errors += response.status_code != 200
+    return {"latencies": latencies, "errors": errors}
+
+
+def run(port: int, async_mode: bool, email: str, args) -> dict:
+    base_url = f"http://127.0.0.1:{port}"
+    paths = ["/client", "/appointment"]
+    server = start_server(port, database_async=async_mode)
+    try:
+        deadline = time.perf_counter() + args.duration
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            results = list(
+                pool.map(
+                    lambda _: worker(base_url, email, paths, deadline),
+                    range(args.concurrency),
+                )
+            )
+    finally:
+        stop_server(server)
+
+    report = {"mode": "async" if async_mode else "sync", "endpoints": {}}
+    for path in paths:
+        samples = [sample for result in results for sample in result["latencies"][path]]
+        report["endpoints"][path] = summarize(samples, args.duration)
+    report["errors"] = sum(result["errors"] for result in results)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--appointments", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    email = seed(args.appointments)
+    reports = [run(args.port, mode, email, args) for mode in (False, True)]
+    json.dump(reports, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Helpers shared by the load benchmarks: a local uvicorn worker and latency
+summaries.
+"""
+import os
+import subprocess
+import sys
+import time
+
+import requests
+
+
+def start_server(port: int, **env) -> subprocess.Popen:
+    """
+    Starts one uvicorn worker serving the app, with the given settings
+    overridden through its environment, and waits until it answers. Rate
+    limiting is off unless overridden, as every simulated user shares one
+    address.
+    """
+    env = {"rate_limit_backend": "none", **env}
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app:app",
+            "--port",
+            str(port),
+            "--no-access-log",
+            "--log-level",
+            "warning",
+        ],
+        env={**os.environ, **{name.upper(): str(value) for name, value in env.items()}},
+    )
+    for _ in range(100):
+        try:
+            requests.get(f"http://127.0.0.1:{port}/")
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start")
+
+
+def stop_server(server: subprocess.Popen):
+    server.terminate()
+    server.wait()
+
+
+def percentile(samples: list, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def summarize(samples: list, duration: float) -> dict:
+    samples = sorted(samples)
+    return {
+        "requests": len(samples),
+        "throughput": len(samples) / duration,
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p95_ms": percentile(samples, 0.95) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+    }
@@ -0,0 +1,182 @@
+"""
+Load benchmark of the main API flows against the benchmark dataset.
+
+    python -m benchmarks.dataset --clients 100000 --appointments 50
+    python -m benchmarks.load --concurrency 32 --duration 30 --output run.json
+
+Starts one uvicorn worker against the configured database, then every
+worker thread logs in as a random benchmark client (and as the admin, for
+appointment creation) and loops over the selected flows on its own
+keep-alive connections. Throughput, latency percentiles, errors and the
+mean X-DB-Queries of every flow are reported as JSON, with the revision and
+parameters, so runs of different releases can be compared.
+"""
+import argparse
+import json
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+from app import utils
+
+from .dataset import PASSWORD, client_ids, email
+from .harness import start_server, stop_server, summarize
+
+ADMIN_USERNAME = "benchmark-admin"
+ADMIN_PASSWORD = "benchmark-admin-password"
+FLOWS = ("login", "get_client", "list_appointments", "create_appointment")
+
+
+def login(http: requests.Session, base_url: str, username: str, password: str):
+    response = http.post(
+        f"{base_url}/auth/login", data={"username": username, "password": password}
+    )
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+class Worker:
+    """
+    One simulated user; tokens are bound to the connection they were issued
+    on, so the client and admin flows each keep their own session
+    """
+
+    def __init__(self, base_url: str, clients: range, seed: int):
+        self.base_url = base_url
+        self.random = random.Random(seed)
+        self.email = email(self.random.randrange(len(clients)))
+        self.clients = clients
+        self.http = requests.Session()
+        self.admin = requests.Session()
+        token = login(self.http, base_url, self.email, PASSWORD)
+        self.http.headers["Authorization"] = f"Bearer {token}"
+        token = login(self.admin, base_url, ADMIN_USERNAME, ADMIN_PASSWORD)
+        self.admin.headers["Authorization"] = f"Bearer {token}"
+
+    def login(self):
+        # A fresh connection, as a client signing in would open
+        with requests.Session() as http:
+            return http.post(
+                f"{self.base_url}/auth/login",
+                data={"username": self.email, "password": PASSWORD},
+            )
+
+    def get_client(self):
+        return self.http.get(f"{self.base_url}/client")
+
+    def list_appointments(self):
+        return self.http.get(f"{self.base_url}/appointment", params={"limit": 50})
+
+    def create_appointment(self):
+        # Far past the seeded weeks, so most land on a free day
+        day = datetime.now() + timedelta(days=self.random.randrange(400, 4000))
+        return self.admin.post(
+            f"{self.base_url}/appointment",
+            json={
+                "client_id": self.random.choice(self.clients),
+                "description": "Mowing",
+                "price": 45,
+                "date": int(day.timestamp()),
+            },
+        )
+
+
+EXPECTED = {"create_appointment": (201, 404, 409)}
+
+
+def run_worker(worker: Worker, flows: list, deadline: float) -> dict:
+    results = {flow: {"latencies": [], "errors": 0, "queries": 0} for flow in flows}
+    while time.perf_counter() < deadline:
+        for flow in flows:
+            start = time.perf_counter()
+            response = getattr(worker, flow)()
+            result = results[flow]
+            result["latencies"].append(time.perf_counter() - start)
+            result["errors"] += response.status_code not in EXPECTED.get(
+                flow, (200, 202)
+            )
+            result["queries"] += int(response.headers.get("X-DB-Queries", 0))
+    return results
+
+
+def revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--flows", default=",".join(FLOWS))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--async-db", action="store_true")
+    parser.add_argument("--no-response-cache", action="store_true")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    flows = args.flows.split(",")
+    if set(flows) - set(FLOWS):
+        parser.error(f"flows must be among {', '.join(FLOWS)}")
+
+    clients = client_ids()
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = start_server(
+        args.port,
+        admin_username=ADMIN_USERNAME,
+        admin_password=utils.hash(ADMIN_PASSWORD),
+        database_async=args.async_db,
+        response_cache_backend="none" if args.no_response_cache else "memory",
+        environment="benchmark",
+    )
+    try:
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            workers = list(
+                pool.map(
+                    lambda index: Worker(base_url, clients, args.seed + index),
+                    range(args.concurrency),
+                )
+            )
+            deadline = time.perf_counter() + args.duration
+            results = list(
+                pool.map(lambda worker: run_worker(worker, flows, deadline), workers)
+            )
+    finally:
+        stop_server(server)
+
+    report = {
+        "revision": revision(),
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "parameters": vars(args),
+        "clients": len(clients),
+        "flows": {},
+    }
+    for flow in flows:
+        samples = [sample for result in results for sample in result[flow]["latencies"]]
+        summary = summarize(samples, args.duration)
+        summary["errors"] = sum(result[flow]["errors"] for result in results)
+        summary["queries_per_request"] = (
+            sum(result[flow]["queries"] for result in results) / len(samples)
+            if samples
+            else 0.0
+        )
+        report["flows"][flow] = summary
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    json.dump(report, output, indent=2)
+    output.write("\n")
+    if args.output:
+        output.close()
+
+
+if __name__ == "__main__":
+    main()
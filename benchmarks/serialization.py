@@ -0,0 +1,87 @@
+"""
+Micro-benchmark of the per-row cost of serializing appointment listings.
+
+    python -m benchmarks.serialization --rows 1000 --repeat 50
+
+"orm_pydantic" is the previous path: ORM entities validated through
+GETAppointmentReturn (orm_mode), run through jsonable_encoder and rendered by
+the stdlib-json JSONResponse. "rows_orjson" is the current one: projected
+rows turned into dicts and rendered by ORJSONResponse. No database is needed;
+rows are built in memory. Results are printed as JSON.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import date, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from sqlalchemy.engine import result_tuple
+
+from app import models, schemas
+
+COLUMNS = ("id", "date", "description", "price", "paid")
+
+
+def make_entities(count: int) -> list:
+    return [
+        models.Appointment(
+            id=index,
+            client_id=1,
+            date=date.today() + timedelta(days=index),
+            description="Mowing",
+            price=45.0,
+            paid=False,
+        )
+        for index in range(count)
+    ]
+
+
+def make_rows(count: int) -> list:
+    make_row = result_tuple(COLUMNS)
+    return [
+        make_row((index, date.today() + timedelta(days=index), "Mowing", 45.0, False))
+        for index in range(count)
+    ]
+
+
+def orm_pydantic(entities: list) -> bytes:
+    content = jsonable_encoder(
+        [schemas.GETAppointmentReturn.from_orm(entity) for entity in entities]
+    )
+    return JSONResponse(content).body
+
+
+def rows_orjson(rows: list) -> bytes:
+    return ORJSONResponse([row._asdict() for row in rows]).body
+
+
+def measure(function, data: list, repeat: int) -> float:
+    function(data)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(data)
+    return (time.perf_counter() - start) / (repeat * len(data))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    before = measure(orm_pydantic, make_entities(args.rows), args.repeat)
+    after = measure(rows_orjson, make_rows(args.rows), args.repeat)
+    report = {
+        "rows": args.rows,
+        "orm_pydantic_us_per_row": before * 1e6,
+        "rows_orjson_us_per_row": after * 1e6,
+        "speedup": before / after,
+    }
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
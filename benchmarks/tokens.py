@@ -0,0 +1,85 @@
+"""
+Micro-benchmark of access token verifications per second.
+
+    python -m benchmarks.tokens --repeat 20000
+
+"jose_pydantic" is the previous path: python-jose's jwt.decode and a
+schemas.TokenData built from the claims. The "native" and "jose" backends of
+app.tokens are measured for every algorithm they support, with freshly
+generated keys; EdDSA is native only. No database is needed. Results are
+printed as JSON.
+"""
+import argparse
+import json
+import sys
+import time
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from jose import jwt
+
+from app import schemas
+from app.tokens import Keyring, make_verifier
+
+CLAIMS = {"client_id": "1", "host": "$2b$04$" + "x" * 53, "host_sig": "y" * 43}
+ALGORITHMS = ("HS256", "ES256", "EdDSA", "RS256")
+
+
+def signing_key(algorithm: str) -> str:
+    if algorithm == "HS256":
+        return "benchmark-secret"
+    key = {
+        "ES256": lambda: ec.generate_private_key(ec.SECP256R1()),
+        "EdDSA": ed25519.Ed25519PrivateKey.generate,
+        "RS256": lambda: rsa.generate_private_key(65537, 2048),
+    }[algorithm]()
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+
+
+def per_second(function, token: str, repeat: int) -> float:
+    function(token)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(token)
+    return repeat / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    claims = {**CLAIMS, "exp": int(time.time()) + 3600}
+    report = {"repeat": args.repeat, "verifications_per_second": {}}
+    results = report["verifications_per_second"]
+
+    secret = signing_key("HS256")
+    token = jwt.encode(claims, secret, algorithm="HS256")
+    results["jose_pydantic_HS256"] = per_second(
+        lambda token: schemas.TokenData(
+            **jwt.decode(token, secret, algorithms=["HS256"])
+        ),
+        token,
+        args.repeat,
+    )
+    for algorithm in ALGORITHMS:
+        keyring = Keyring(algorithm, signing_key(algorithm), "benchmark")
+        token = keyring.sign(claims)
+        for backend in ("native", "jose"):
+            if backend == "jose" and algorithm == "EdDSA":
+                continue
+            verifier = make_verifier(keyring, backend)
+            results[f"{backend}_{algorithm}"] = per_second(
+                verifier.verify, token, args.repeat
+            )
+    report["speedup_HS256"] = results["native_HS256"] / results["jose_pydantic_HS256"]
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,43 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from fastapi.testclient import TestClient
-from app import app, utils
+from app import app, oauth2, ratelimit, utils
+from app.cache import response_cache
 from app.config import settings
-from app.database import Base, get_db
+from app.database import Base, ThreadpoolSession, get_db
+from app.metrics import time_queries
 import pytest
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.database_username}:{settings.database_password}@{settings.database_address}:{settings.database_port}/{settings.database_name}_test"
+SQLALCHEMY_ASYNC_DATABASE_URL = f"postgresql+asyncpg://{settings.database_username}:{settings.database_password}@{settings.database_address}:{settings.database_port}/{settings.database_name}_test"
 
 settings.admin_username = settings.testing_admin_username
 settings.admin_password = utils.hash(settings.testing_admin_password)
 
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
+time_queries(engine)
 
 TestSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# TestClient runs every request on a fresh event loop, so asyncpg connections
+# cannot be pooled between requests
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL, poolclass=NullPool)
+time_queries(async_engine.sync_engine)
+
+TestAsyncSessionLocal = sessionmaker(
+    bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
 
 @pytest.fixture
 def session() -> TestSessionLocal:
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+    response_cache.clear()
+    oauth2.client_cache.clear()
+    ratelimit.limiter.clear()
     db = TestSessionLocal()
     try:
         yield db
@@ -31,9 +49,19 @@ def session() -> TestSessionLocal:
 def client(session) -> TestClient:
     def override_get_db():
         try:
-            yield session
+            yield ThreadpoolSession(session)
         finally:
             session.close()
 
-    app.dependency_overrides[get_db] = override_get_db
+    async def override_get_async_db():
+        db = TestAsyncSessionLocal()
+        try:
+            yield db
+        finally:
+            await db.close()
+
+    if settings.database_async:
+        app.dependency_overrides[get_db] = override_get_async_db
+    else:
+        app.dependency_overrides[get_db] = override_get_db
     yield TestClient(app)
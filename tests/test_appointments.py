@@ -0,0 +1,360 @@
+from datetime import date, datetime, timedelta
+from app.oauth2 import create_access_token
+from fastapi import status
+from app import models, utils
+from app.cache import response_cache
+import orjson
+import pytest
+from sqlalchemy import delete, select, update
+from .database import client, session, TestSessionLocal, TestClient
+from .test_clients import add_client, sample_client, sample_client_data
+
+
+def add_appointment(session, client_id: int, days: int, paid: bool = False):
+    appointment = models.Appointment(
+        client_id=client_id,
+        date=date.today() + timedelta(days=days),
+        description="Mowing",
+        price=45.0,
+        paid=paid,
+    )
+    session.add(appointment)
+    session.commit()
+    return appointment
+
+
+@pytest.fixture
+def other_client(session) -> models.Client:
+    return add_client(
+        {
+            "name": "Other Client",
+            "email": "other@example.com",
+            "address": "1 Other Street",
+            "password": "password",
+            "phone_number": "555-0100",
+        },
+        session,
+    )
+
+
+def authorize(client: TestClient, client_id: int):
+    token = create_access_token(
+        {
+            "client_id": client_id,
+            "host": utils.hash("localhost", 5432),
+            "testing": "True",
+        }
+    )
+    client.headers = {**client.headers, "Authorization": f"Bearer {token}"}
+
+
+def test_appointment_get_unpaid(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    add_appointment(session, sample_client.id, 2)
+    add_appointment(session, sample_client.id, 3, paid=True)
+    authorize(client, sample_client.id)
+    response = client.get("/appointment", params={"paid": False})
+    assert response.status_code == status.HTTP_200_OK
+    json = response.json()
+    assert len(json) == 1
+    assert json[0]["paid"] is False
+
+    response = client.get("/appointment")
+    assert len(response.json()) == 2
+
+
+def test_appointment_get_by_id(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    other_client: models.Client,
+):
+    other_client_id = other_client.id
+    appointment_id = add_appointment(session, sample_client.id, 2).id
+    authorize(client, sample_client.id)
+    response = client.get("/appointment", params={"appointment_id": appointment_id})
+    assert response.status_code == status.HTTP_200_OK
+    json = response.json()
+    assert json["id"] == appointment_id
+    assert set(json) == {"id", "date", "description", "price", "paid"}
+
+    authorize(client, other_client_id)
+    response = client.get("/appointment", params={"appointment_id": appointment_id})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_appointment_get_paginated(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    for days in range(5, 0, -1):
+        add_appointment(session, sample_client.id, days)
+    authorize(client, sample_client.id)
+
+    dates = []
+    cursor = None
+    while True:
+        params = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+        response = client.get("/appointment", params=params)
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()) <= 2
+        dates += [appointment["date"] for appointment in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert len(dates) == 5
+    assert dates == sorted(dates)
+
+
+def test_appointment_get_invalid_cursor(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    authorize(client, sample_client.id)
+    response = client.get("/appointment", params={"cursor": "not-a-cursor"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_appointment_get_stream(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    for days in range(1, 4):
+        add_appointment(session, sample_client.id, days)
+    authorize(client, sample_client.id)
+    response = client.get("/appointment", params={"stream": True})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [orjson.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 3
+    assert [line["date"] for line in lines] == sorted(line["date"] for line in lines)
+
+
+def test_admin_search_appointments(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    add_appointment(session, sample_client.id, 1)
+    add_appointment(session, sample_client.id, 2, paid=True)
+    add_appointment(session, sample_client.id, 10)
+    name, address = sample_client.name, sample_client.address
+    authorize(client, 0)
+    today = datetime.combine(date.today(), datetime.min.time())
+    response = client.get(
+        "/appointment/search",
+        params={
+            "start": int(today.timestamp()),
+            "end": int((today + timedelta(days=5)).timestamp()),
+            "paid": False,
+        },
+    )
+    assert response.status_code == status.HTTP_200_OK
+    json = response.json()
+    assert len(json) == 1
+    assert json[0]["client_name"] == name
+    assert json[0]["client_address"] == address
+
+
+def test_search_appointments_requires_admin(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    authorize(client, sample_client.id)
+    response = client.get("/appointment/search", params={"start": 0, "end": 0})
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_admin_bulk_create_appointments(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    client_id = sample_client.id
+    existing = add_appointment(session, client_id, 14)
+    existing_date = existing.date
+    authorize(client, 0)
+    start = datetime.combine(date.today() + timedelta(days=2), datetime.min.time())
+    response = client.post(
+        "/appointment/bulk",
+        json={
+            "appointments": [
+                {
+                    "client_id": client_id,
+                    "description": "Edging",
+                    "price": 20,
+                    "date": int(start.timestamp()),
+                },
+                {
+                    "client_id": client_id,
+                    "description": "",
+                    "price": 20,
+                    "date": int((start + timedelta(days=1)).timestamp()),
+                },
+            ],
+            "recurrences": [
+                {
+                    "client_id": client_id,
+                    "description": "Mowing",
+                    "price": 45,
+                    "weekday": existing_date.weekday(),
+                    "start": int((start + timedelta(days=1)).timestamp()),
+                    "end": int((start + timedelta(weeks=4)).timestamp()),
+                },
+            ],
+        },
+    )
+    assert response.status_code == status.HTTP_200_OK
+    json = response.json()
+    statuses = [result["status"] for result in json]
+    assert statuses[:2] == ["created", "invalid"]
+    assert statuses.count("conflict") == 1
+    assert statuses.count("created") == len(json) - 2
+    created = session.query(models.Appointment).filter(
+        models.Appointment.client_id == client_id
+    )
+    assert created.count() == len(json) - 1
+
+
+def test_admin_make_appointment(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    client_id = sample_client.id
+    authorize(client, 0)
+    appointment = {
+        "client_id": client_id,
+        "description": "Mowing",
+        "price": 45,
+        "date": int((datetime.now() + timedelta(days=3)).timestamp()),
+    }
+    response = client.post("/appointment", json=appointment)
+    assert response.status_code == status.HTTP_201_CREATED
+    json = response.json()
+    assert json["id"]
+    assert json["paid"] is False
+
+    response = client.post("/appointment", json=appointment)
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert session.query(models.Appointment).count() == 1
+
+
+def test_admin_make_appointment_missing_client(
+    client: TestClient, session: TestSessionLocal
+):
+    authorize(client, 0)
+    response = client.post(
+        "/appointment",
+        json={
+            "client_id": 1,
+            "description": "Mowing",
+            "price": 45,
+            "date": int((datetime.now() + timedelta(days=3)).timestamp()),
+        },
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_appointment_cancel(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    appointment_id = add_appointment(session, sample_client.id, 2).id
+    authorize(client, sample_client.id)
+    response = client.delete("/appointment", params={"id": appointment_id})
+    assert response.status_code == status.HTTP_200_OK
+    assert not session.query(models.Appointment).count()
+
+    response = client.delete("/appointment", params={"id": appointment_id})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_appointment_cancel_bulk(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    ids = [add_appointment(session, sample_client.id, days).id for days in (1, 2, 3)]
+    authorize(client, sample_client.id)
+    response = client.delete("/appointment/bulk", params={"id": ids[:2] + [999]})
+    assert response.status_code == status.HTTP_200_OK
+    assert sorted(response.json()) == ids[:2]
+    assert [appointment.id for appointment in session.query(models.Appointment)] == [
+        ids[2]
+    ]
+
+
+def test_appointment_cancel_bulk_other_client(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    other_client: models.Client,
+):
+    ids = [add_appointment(session, sample_client.id, days).id for days in (1, 2)]
+    authorize(client, other_client.id)
+    response = client.delete("/appointment/bulk", params={"id": ids})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == []
+    assert session.query(models.Appointment).count() == 2
+
+
+def test_client_version_bumped_once_per_statement(
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    other_client: models.Client,
+):
+    client_ids = (sample_client.id, other_client.id)
+    for client_id in client_ids:
+        for days in (1, 2):
+            add_appointment(session, client_id, days)
+
+    def versions() -> list:
+        return session.scalars(
+            select(models.Client.version)
+            .where(models.Client.id.in_(client_ids))
+            .order_by(models.Client.id)
+        ).all()
+
+    assert versions() == [2, 2]
+    session.execute(update(models.Appointment).values(price=50))
+    session.commit()
+    assert versions() == [3, 3]
+    session.execute(
+        delete(models.Appointment).where(
+            models.Appointment.client_id == sample_client.id
+        )
+    )
+    session.commit()
+    assert versions() == [4, 3]
+
+
+def test_appointment_get_not_modified(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    client_id = sample_client.id
+    add_appointment(session, client_id, 2)
+    authorize(client, client_id)
+    response = client.get("/appointment")
+    assert response.status_code == status.HTTP_200_OK
+    tag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "private, no-cache"
+
+    response = client.get("/appointment", headers={"If-None-Match": tag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert not response.content
+
+    response = client.get(
+        "/appointment", params={"paid": True}, headers={"If-None-Match": tag}
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    # Written behind the API's back, as another worker or the importer would
+    add_appointment(session, client_id, 3)
+    response = client.get("/appointment", headers={"If-None-Match": tag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["ETag"] != tag
+    assert len(response.json()) == 2
+
+
+def test_appointment_get_cached_until_cancel(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    ids = [add_appointment(session, sample_client.id, days).id for days in (1, 2)]
+    authorize(client, sample_client.id)
+    assert len(client.get("/appointment").json()) == 2
+    assert len(client.get("/appointment").json()) == 2
+    assert response_cache.hits == 1
+
+    response = client.delete("/appointment", params={"id": ids[0]})
+    assert response.status_code == status.HTTP_200_OK
+    assert [row["id"] for row in client.get("/appointment").json()] == ids[1:]
+    assert response_cache.hits == 1
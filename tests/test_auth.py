@@ -0,0 +1,142 @@
+import asyncio
+from threading import BoundedSemaphore
+from time import time
+from fastapi import HTTPException, status
+from queue import Empty, Queue
+from sqlalchemy import text
+from app import oauth2, schemas, utils, config, models
+from app.cache import TTLCache
+from app.database import ThreadpoolSession
+from app.notify import CLIENT_CHANGED, Listener
+from app.oauth2 import create_access_token
+import pytest
+from .database import client, session, TestSessionLocal, TestClient
+from .database import SQLALCHEMY_DATABASE_URL
+from .test_clients import sample_client, sample_client_data
+
+
+@pytest.fixture
+def token_cache():
+    oauth2.token_cache.clear()
+    oauth2.token_cache.hits = oauth2.token_cache.misses = 0
+    yield oauth2.token_cache
+    oauth2.token_cache.clear()
+
+
+def make_token_data(host: str, port: int, signed: bool = True) -> schemas.TokenData:
+    return schemas.TokenData(
+        client_id="1",
+        host=utils.hash(host, port),
+        host_sig=utils.sign(host, port) if signed else None,
+        exp=int(time()) + oauth2.EXPIRE_SECONDS,
+    )
+
+
+@pytest.mark.parametrize("signed", (True, False))
+def test_validate_access_token_cached(token_cache: TTLCache, signed: bool):
+    token_data = make_token_data("localhost", 5432, signed)
+    asyncio.run(oauth2.validate_access_token("localhost", 5432, token_data))
+    asyncio.run(oauth2.validate_access_token("localhost", 5432, token_data))
+    assert token_cache.misses == 1
+    assert token_cache.hits == 1
+
+
+@pytest.mark.parametrize("signed", (True, False))
+def test_validate_access_token_wrong_host(token_cache: TTLCache, signed: bool):
+    token_data = make_token_data("localhost", 5432, signed)
+    asyncio.run(oauth2.validate_access_token("localhost", 5432, token_data))
+    with pytest.raises(HTTPException):
+        asyncio.run(oauth2.validate_access_token("localhost", 5433, token_data))
+    assert len(token_cache) == 1
+
+
+def test_validate_access_token_expired(token_cache: TTLCache):
+    token_data = make_token_data("localhost", 5432)
+    token_data.exp = int(time()) - 1
+    asyncio.run(oauth2.validate_access_token("localhost", 5432, token_data))
+    assert len(token_cache) == 0
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_login_sheds_load_when_hashing_queue_full(
+    client: TestClient, session: TestSessionLocal, monkeypatch
+):
+    exhausted = BoundedSemaphore(1)
+    exhausted.acquire()
+    monkeypatch.setattr(utils, "_hashing_slots", exhausted)
+    response = client.post(
+        "/auth/login",
+        data={
+            "username": config.settings.testing_admin_username,
+            "password": config.settings.testing_admin_password,
+        },
+    )
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers.get("Retry-After")
+
+
+def test_client_exists_cache_invalidated_on_delete(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    client_id = sample_client.id
+    oauth2.client_cache.clear()
+    token = create_access_token(
+        {"client_id": 0, "host": utils.hash("localhost", 5432), "testing": "True"}
+    )
+    client.headers = {**client.headers, "Authorization": f"Bearer {token}"}
+    assert asyncio.run(oauth2.client_exists(ThreadpoolSession(session), client_id))
+    assert oauth2.client_cache.get(client_id) is True
+
+    response = client.delete("/client", params={"id": client_id})
+    assert response.status_code == status.HTTP_200_OK
+    assert oauth2.client_cache.get(client_id) is None
+
+
+def test_token_of_deleted_client_rejected(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    client_id = sample_client.id
+    token = create_access_token(
+        {
+            "client_id": client_id,
+            "host": utils.hash("localhost", 5432),
+            "testing": "True",
+        }
+    )
+    client.headers = {**client.headers, "Authorization": f"Bearer {token}"}
+    assert client.get("/client").status_code == status.HTTP_200_OK
+    assert oauth2.client_cache.get(client_id) is True
+
+    assert client.delete("/client").status_code == status.HTTP_200_OK
+    response = client.get("/client")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_listener_dispatches_notifications(session: TestSessionLocal):
+    received = Queue()
+    listener = Listener(SQLALCHEMY_DATABASE_URL, poll_seconds=0.1)
+    listener.subscribe(CLIENT_CHANGED, received.put)
+    listener.start()
+    try:
+        for _ in range(50):
+            session.execute(text(f"NOTIFY {CLIENT_CHANGED}, '7'"))
+            session.commit()
+            try:
+                assert received.get(timeout=0.1) == "7"
+                break
+            except Empty:
+                continue
+        else:
+            pytest.fail("Notification was not delivered")
+    finally:
+        listener.stop()
@@ -0,0 +1,72 @@
+import asyncio
+from app.cache import MemoryBackend, RedisBackend, ResponseCache
+import pytest
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value
+
+
+@pytest.fixture(params=["memory", "redis"])
+def cache(request) -> ResponseCache:
+    if request.param == "memory":
+        return ResponseCache(MemoryBackend(1024), ttl=30)
+    return ResponseCache(RedisBackend(FakeRedis()), ttl=30)
+
+
+def test_response_cache_keyed_by_version(cache: ResponseCache):
+    async def run():
+        cached, slot = await cache.get(1, 1, "appointments", "paid=true")
+        assert cached is None
+        await cache.set(slot, b"[]", {"etag": '"tag"'})
+        cached, _ = await cache.get(1, 1, "appointments", "paid=true")
+        assert cached.body == b"[]"
+        assert cached.headers == {"etag": '"tag"'}
+
+        # A response computed before a write is stored under the old version
+        # and never served once the write commits
+        _, stale_slot = await cache.get(1, 1, "appointments", "")
+        await cache.set(stale_slot, b"[]", {})
+        assert (await cache.get(1, 2, "appointments", "paid=true"))[0] is None
+        assert (await cache.get(1, 2, "appointments", ""))[0] is None
+
+    asyncio.run(run())
+    assert cache.stats()["hit_ratio"] == 0.2
+
+
+def test_memory_backend_max_bytes():
+    async def run():
+        backend = MemoryBackend(10)
+        await backend.set("a", b"12345")
+        await backend.set("b", b"12345")
+        await backend.get("a")
+        await backend.set("c", b"123")
+        assert await backend.get("b") is None
+        assert await backend.get("a") == b"12345"
+        await backend.set("d", b"12345678901")
+        assert await backend.get("d") is None
+        return backend.stats()
+
+    assert asyncio.run(run()) == {
+        "backend": "memory",
+        "size": 2,
+        "bytes": 8,
+        "max_bytes": 10,
+    }
+
+
+def test_disabled_response_cache():
+    async def run():
+        cache = ResponseCache()
+        cached, slot = await cache.get(1, 0, "client")
+        await cache.set(slot, b"{}", {})
+        return cached, slot
+
+    assert asyncio.run(run()) == (None, None)
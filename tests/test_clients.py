@@ -1,5 +1,5 @@
 import pydantic
-from app.oauth2 import create_access_token, verify_access_token
+from app.oauth2 import create_access_token, decode_access_token
 from fastapi import status
 from app import models, utils, schemas, config
 import pytest
@@ -113,7 +113,7 @@ def test_client_login(
     assert response.status_code == status.HTTP_202_ACCEPTED
     json = response.json()
     assert json
-    assert verify_access_token(json.get("access_token"))
+    assert decode_access_token(json.get("access_token"))
 
 
 def test_client_login_does_not_exist(
@@ -204,7 +204,7 @@ def test_admin_login(client: TestClient, session: TestSessionLocal):
     json = response.json()
     assert json
     assert json.get("token_type") == "bearer"
-    token = verify_access_token(json.get("access_token"))
+    token = decode_access_token(json.get("access_token"))
     assert token.client_id == "0"
 
 
@@ -234,3 +234,32 @@ def test_admin_delete_client(
     assert response.status_code == status.HTTP_200_OK
     queried_client = session.query(models.Client).filter(models.Client.id == 1).first()
     assert not queried_client
+
+
+def test_admin_delete_client_does_not_exist(
+    client: TestClient, session: TestSessionLocal
+):
+    token = create_access_token(
+        {"client_id": 0, "host": utils.hash("localhost", 5432), "testing": "True"}
+    )
+    client.headers = {**client.headers, "Authorization": f"Bearer {token}"}
+    response = client.delete("/client", params={"id": 1})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_client_get_not_modified(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    token = create_access_token(
+        {
+            "client_id": sample_client.id,
+            "host": utils.hash("localhost", 5432),
+            "testing": "True",
+        }
+    )
+    client.headers = {**client.headers, "Authorization": f"Bearer {token}"}
+    response = client.get("/client")
+    assert response.status_code == status.HTTP_200_OK
+    tag = response.headers["ETag"]
+    response = client.get("/client", headers={"If-None-Match": tag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
@@ -0,0 +1,158 @@
+import asyncio
+from fastapi import status
+from sqlalchemy import delete, update
+from app import app, events, models, oauth2
+from app.config import settings
+from app.database import ThreadpoolSession, get_db
+from app.notify import APPOINTMENT_CHANGED, Listener
+from .database import client, engine, session, TestClient, TestSessionLocal
+from .database import SQLALCHEMY_DATABASE_URL
+from .test_appointments import add_appointment, authorize
+from .test_clients import sample_client, sample_client_data
+
+
+def event(client_id: int, id: int = 1, kind: str = "created") -> dict:
+    return {"event": kind, "id": id, "client_id": client_id}
+
+
+def test_broker_fans_out_to_client_and_admin_streams():
+    async def run():
+        broker = events.EventBroker(queue_size=10)
+        own, other, admin = (broker.subscribe(id) for id in (1, 2, None))
+        broker.dispatch(event(1))
+        assert own.queue.get_nowait() == event(1)
+        assert admin.queue.get_nowait() == event(1)
+        assert other.queue.empty()
+
+        broker.unsubscribe(own)
+        broker.dispatch(event(1, 2))
+        assert own.queue.empty()
+        assert broker.subscribers == 2
+
+    asyncio.run(run())
+
+
+def test_stream_formats_events_and_drops_slow_subscriber():
+    async def run():
+        broker = events.EventBroker(queue_size=2)
+        stream = broker.stream(1, heartbeat_seconds=0.01)
+        assert await stream.__anext__() == "retry: 3000\n\n"
+        assert await stream.__anext__() == ": keep-alive\n\n"
+        broker.dispatch(event(1))
+        assert await stream.__anext__() == (
+            'event: created\ndata: {"event":"created","id":1,"client_id":1}\n\n'
+        )
+        # The third event overflows the queue, which ends the stream
+        for id in range(3):
+            broker.dispatch(event(1, id))
+        assert [chunk async for chunk in stream] == []
+        assert broker.subscribers == 0
+
+    asyncio.run(run())
+
+
+def test_stream_ends_at_deadline():
+    async def run():
+        broker = events.EventBroker(queue_size=2)
+        chunks = [chunk async for chunk in broker.stream(1, 10, until=0)]
+        assert chunks == ["retry: 3000\n\n"]
+        assert broker.subscribers == 0
+
+    asyncio.run(run())
+
+
+def test_triggers_notify_appointment_changes(
+    session: TestSessionLocal, sample_client: models.Client
+):
+    client_id = sample_client.id
+
+    async def run():
+        broker = events.EventBroker(queue_size=10)
+        subscription = broker.subscribe(client_id)
+        listener = Listener(SQLALCHEMY_DATABASE_URL, poll_seconds=0.1)
+        listener.subscribe(APPOINTMENT_CHANGED, broker.publish)
+        listener.start()
+        try:
+            # Until the listener's LISTEN is in place
+            while subscription.queue.empty():
+                add_appointment(session, client_id, 2)
+                await asyncio.sleep(0.2)
+                session.execute(delete(models.Appointment))
+                session.commit()
+            await asyncio.sleep(0.2)
+            while not subscription.queue.empty():
+                subscription.queue.get_nowait()
+
+            appointment_id = add_appointment(session, client_id, 3).id
+            session.execute(update(models.Appointment).values(paid=True))
+            session.execute(update(models.Appointment).values(price=50))
+            session.execute(delete(models.Appointment))
+            session.commit()
+            received = [
+                await asyncio.wait_for(subscription.queue.get(), 5) for _ in range(3)
+            ]
+        finally:
+            listener.stop()
+        assert [event["event"] for event in received] == [
+            "created",
+            "paid",
+            "cancelled",
+        ]
+        assert {event["id"] for event in received} == {appointment_id}
+        assert received[1]["paid"] is True
+
+    asyncio.run(run())
+
+
+def test_events_endpoint(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    monkeypatch,
+):
+    client_id = sample_client.id
+    authorize(client, client_id)
+    response = client.get("/appointment/events", params={"client_id": client_id})
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    # A stream past its deadline ends right after the reconnect delay
+    monkeypatch.setattr(settings, "appointment_events_max_seconds", 0)
+    response = client.get("/appointment/events")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.text == "retry: 3000\n\n"
+
+    monkeypatch.setattr(settings, "appointment_events", False)
+    response = client.get("/appointment/events")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_events_stream_holds_no_connection(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    monkeypatch,
+):
+    client_id = sample_client.id
+    session.close()
+
+    def get_pooled_db():
+        try:
+            yield ThreadpoolSession(session)
+        finally:
+            session.close()
+
+    checked_out = []
+
+    async def stream(*args):
+        checked_out.append(engine.pool.checkedout())
+        yield "retry: 3000\n\n"
+
+    monkeypatch.setitem(app.dependency_overrides, get_db, get_pooled_db)
+    monkeypatch.setattr(events.broker, "stream", stream)
+    authorize(client, client_id)
+    response = client.get("/appointment/events")
+    assert response.status_code == status.HTTP_200_OK
+    # The client existence check ran, then its connection went back
+    assert oauth2.client_cache.get(client_id) is True
+    assert checked_out == [0]
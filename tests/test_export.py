@@ -0,0 +1,47 @@
+import csv
+import io
+from fastapi import status
+from app import models
+import orjson
+from .database import client, session, TestSessionLocal, TestClient
+from .test_appointments import add_appointment, authorize
+from .test_clients import sample_client, sample_client_data
+
+
+def test_export_unpaid_appointments_csv(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    email = sample_client.email
+    for days, paid in ((1, False), (2, True), (3, False)):
+        add_appointment(session, sample_client.id, days, paid)
+    authorize(client, 0)
+    response = client.get(
+        "/export/appointments", params={"format": "csv", "paid": False}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/csv")
+    assert "appointments.csv" in response.headers["content-disposition"]
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 2
+    assert {row["paid"] for row in rows} == {"False"}
+    assert rows[0]["client_email"] == email
+
+
+def test_export_clients_ndjson(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    email = sample_client.email
+    authorize(client, 0)
+    response = client.get("/export/clients")
+    assert response.status_code == status.HTTP_200_OK
+    rows = [orjson.loads(line) for line in response.text.splitlines()]
+    assert [row["email"] for row in rows] == [email]
+    assert "password" not in rows[0]
+
+
+def test_export_requires_admin(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    authorize(client, sample_client.id)
+    response = client.get("/export/clients")
+    assert response.status_code == status.HTTP_403_FORBIDDEN
@@ -0,0 +1,121 @@
+import json
+from datetime import date, timedelta
+from sqlalchemy import text
+from app import models, utils
+from app.importer import import_appointments, import_clients, read_rows
+from .database import session, engine, TestSessionLocal
+from .test_clients import sample_client, sample_client_data
+
+CLIENTS_CSV = """name,email,phone_number,password,address
+Jane Doe,jane@example.com,555-555-0101,password-jane,12 Elm Street
+John Roe,john@example.com,555-555-0102,password-john,34 Oak Avenue
+Jane Again,jane@example.com,555-555-0103,password-jane2,56 Pine Road
+Bad Row,not-an-email,555-555-0104,password-bad,78 Birch Lane
+"""
+
+
+def import_file(tmp_path, name: str, content: str, function, **kwargs):
+    path = tmp_path / name
+    path.write_text(content)
+    connection = engine.raw_connection()
+    try:
+        result = function(connection, read_rows(str(path)), **kwargs)
+        connection.commit()
+    finally:
+        connection.close()
+    return result
+
+
+def test_import_clients(
+    tmp_path, session: TestSessionLocal, sample_client: models.Client
+):
+    existing = (
+        f"Renamed,{sample_client.email},555-555-0105,password-new,90 Cedar Court\n"
+    )
+    report, updated = import_file(
+        tmp_path,
+        "clients.csv",
+        CLIENTS_CSV + existing,
+        import_clients,
+        workers=2,
+        update_existing=True,
+    )
+    assert report["rows"] == 5
+    assert (report["created"], report["updated"], report["skipped"]) == (2, 1, 1)
+    assert [row["line"] for row in report["invalid"]] == [4]
+    assert updated == {sample_client.id}
+
+    session.expire_all()
+    jane = session.query(models.Client).filter_by(email="jane@example.com").one()
+    assert jane.name == "Jane Doe"
+    assert utils.verify("password-jane", jane.password)
+    renamed = session.get(models.Client, sample_client.id)
+    assert renamed.name == "Renamed"
+    # So its cached responses are not served any more
+    assert renamed.version == 1
+    assert not utils.verify("password-new", renamed.password)
+
+
+def test_import_appointments(
+    tmp_path, session: TestSessionLocal, sample_client: models.Client
+):
+    version = sample_client.version
+    day = date.today() - timedelta(days=30)
+    rows = [
+        {
+            "client_email": sample_client.email,
+            "date": str(day),
+            "description": "Mowing",
+            "price": 45,
+            "paid": True,
+        },
+        {
+            "client_email": sample_client.email,
+            "date": str(day + timedelta(days=7)),
+            "description": "Edging",
+            "price": 30,
+        },
+        {
+            "client_email": sample_client.email,
+            "date": str(day),
+            "description": "Mowing",
+            "price": 45,
+        },
+        {
+            "client_email": "nobody@example.com",
+            "date": str(day),
+            "description": "Mowing",
+            "price": 45,
+        },
+        {
+            "client_email": sample_client.email,
+            "date": "yesterday",
+            "description": "Mowing",
+            "price": 45,
+        },
+    ]
+    report, client_ids = import_file(
+        tmp_path,
+        "appointments.jsonl",
+        "\n".join(json.dumps(row) for row in rows),
+        import_appointments,
+    )
+    assert (report["created"], report["unknown_client"], report["skipped"]) == (2, 1, 1)
+    assert [row["line"] for row in report["invalid"]] == [5]
+    assert client_ids == {sample_client.id}
+
+    appointments = session.query(models.Appointment).order_by(models.Appointment.date)
+    assert [(a.date, a.paid) for a in appointments] == [
+        (day, True),
+        (day + timedelta(days=7), False),
+    ]
+    # Once for the import, not once per appointment
+    session.expire_all()
+    assert session.get(models.Client, sample_client.id).version == version + 1
+    triggers = session.execute(
+        text(
+            "SELECT tgname FROM pg_trigger"
+            " WHERE tgrelid = 'appointments'::regclass AND tgenabled = 'D'"
+        )
+    ).all()
+    assert triggers == []
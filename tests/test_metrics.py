@@ -0,0 +1,154 @@
+from fastapi import status
+from sqlalchemy import create_engine, text
+from app import app, models
+from app.metrics import Histogram, InstrumentedQueuePool, PoolMetrics, RequestMetrics
+from app.metrics import RequestTimer, TimingMiddleware, request_metrics
+from app.metrics import scrub_parameters, time_queries
+import pytest
+from .database import client, session, TestSessionLocal, TestClient
+from .database import SQLALCHEMY_DATABASE_URL
+from .test_appointments import add_appointment, authorize
+from .test_clients import sample_client, sample_client_data
+
+
+def test_histogram_quantiles():
+    histogram = Histogram(buckets=(1, 2, 3, 4))
+    for value in (0.5, 1.5, 2.5, 3.5):
+        histogram.observe(value)
+    assert histogram.count == 4
+    assert histogram.quantile(0.5) == pytest.approx(2)
+    assert histogram.quantile(1) == pytest.approx(4)
+    assert histogram.snapshot()["buckets"]["+Inf"] == 4
+
+
+def test_pool_metrics_counts_checkouts():
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=InstrumentedQueuePool)
+    metrics = PoolMetrics(engine)
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+        assert metrics.snapshot()["checked_out"] == 1
+    snapshot = metrics.snapshot()
+    assert snapshot["connects"] == 1
+    assert snapshot["checkouts"] == snapshot["checkins"] == 1
+    assert snapshot["checkout_wait_seconds"]["count"] == 1
+    engine.dispose()
+
+
+def test_debug_pool(client: TestClient, session: TestSessionLocal):
+    authorize(client, 0)
+    response = client.get("/debug/pool")
+    assert response.status_code == status.HTTP_200_OK
+    assert "checked_out" in response.json()["primary"]
+
+
+def test_debug_pool_requires_admin(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    authorize(client, sample_client.id)
+    response = client.get("/debug/pool")
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_debug_cache(client: TestClient, session: TestSessionLocal):
+    authorize(client, 0)
+    response = client.get("/debug/cache")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["response"]["backend"] == "memory"
+
+
+@pytest.fixture
+def requests() -> RequestMetrics:
+    request_metrics.routes.clear()
+    return request_metrics
+
+
+def test_request_timing_by_route(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    requests: RequestMetrics,
+):
+    add_appointment(session, sample_client.id, 1)
+    authorize(client, sample_client.id)
+    assert client.get("/appointment").status_code == status.HTTP_200_OK
+    assert client.get("/no-such-path").status_code == status.HTTP_404_NOT_FOUND
+
+    route = requests.routes[("GET", "/appointment")]
+    assert route.statuses == {200: 1}
+    assert route.latency.count == 1
+    assert 0 < route.seconds["db"] < route.latency.sum
+    assert route.seconds["serialization"] > 0
+    assert requests.routes[("GET", "unmatched")].statuses == {404: 1}
+
+
+def test_prometheus_metrics(
+    client: TestClient, session: TestSessionLocal, requests: RequestMetrics
+):
+    client.get("/")
+    response = client.get("/metrics")
+    assert response.status_code == status.HTTP_200_OK
+    lines = response.text.splitlines()
+    assert 'lawncare_requests_total{method="GET",route="/",status="204"} 1' in lines
+    assert any(
+        line.startswith('lawncare_pool_checked_out{pool="primary"}') for line in lines
+    )
+    assert any(
+        line.startswith('lawncare_cache_hits_total{cache="token"}') for line in lines
+    )
+
+
+@pytest.fixture
+def query_header(client: TestClient, monkeypatch):
+    middleware = app.middleware_stack
+    while not isinstance(middleware, TimingMiddleware):
+        middleware = middleware.app
+    monkeypatch.setattr(middleware, "query_header", True)
+
+
+def test_query_count_header(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    query_header,
+):
+    add_appointment(session, sample_client.id, 1)
+    authorize(client, sample_client.id)
+    # Client existence, its version for the ETag, then the page
+    assert client.get("/appointment").headers["X-DB-Queries"] == "3"
+    # Only the version, the rest from the client and response caches
+    assert client.get("/appointment").headers["X-DB-Queries"] == "1"
+
+
+def test_scrub_parameters():
+    assert scrub_parameters({"email": "a@b.c", "password": "hunter2"}) == {
+        "email": "a@b.c",
+        "password": "<redacted>",
+    }
+    assert scrub_parameters([{"password_1": "x"}], many=True) == [
+        {"password_1": "<redacted>"}
+    ]
+    assert scrub_parameters(("hunter2",)) == "<redacted>"
+
+
+def test_slow_query_logged_without_secrets(caplog):
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    time_queries(engine, slow_query_seconds=1e-9)
+    with engine.connect() as connection:
+        connection.execute(
+            text("SELECT :email, :password"),
+            {"email": "a@b.c", "password": "hunter2"},
+        )
+    engine.dispose()
+    assert "Slow query" in caplog.text
+    assert "a@b.c" in caplog.text
+    assert "hunter2" not in caplog.text
+
+
+def test_repeated_queries_flagged(caplog):
+    middleware = TimingMiddleware(None, RequestMetrics(), repeated_query_threshold=3)
+    timer = RequestTimer("GET /appointment")
+    timer.statements = {"SELECT clients": 1, "SELECT appointments": 2}
+    assert not middleware.check_repeated(timer)
+    timer.statements["SELECT appointments"] = 3
+    assert middleware.check_repeated(timer)
+    assert "likely N+1" in caplog.text
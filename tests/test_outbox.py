@@ -0,0 +1,353 @@
+import smtplib
+import socketserver
+import threading
+from datetime import datetime, timedelta
+from email import message_from_bytes
+from fastapi import status
+from sqlalchemy import func, select, update
+from app import models, outbox
+import pytest
+from .database import client, engine, session, TestClient, TestSessionLocal
+from .test_appointments import authorize
+from .test_clients import sample_client, sample_client_data
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Just enough SMTP for smtplib: every message is recorded, and recipients
+    in the server's reject set get a 550
+    """
+
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 fake ESMTP")
+        recipients = []
+        while line := self.rfile.readline():
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 fake")
+            elif verb == "MAIL":
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipient = command.split(":", 1)[1].strip("<> ")
+                if recipient in self.server.reject:
+                    self.reply("550 No such user")
+                else:
+                    recipients.append(recipient)
+                    self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = b""
+                while (line := self.rfile.readline()) != b".\r\n":
+                    data += line
+                self.server.messages.append((recipients, message_from_bytes(data)))
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+@pytest.fixture
+def smtp_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeSMTPHandler)
+    server.daemon_threads = True
+    server.messages = []
+    server.reject = set()
+    server.connections = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def worker(smtp_server) -> outbox.OutboxWorker:
+    mailer = outbox.Mailer(*smtp_server.server_address)
+    yield outbox.OutboxWorker(
+        engine, mailer, batch_size=10, max_attempts=3, backoff_seconds=60
+    )
+    mailer.close()
+
+
+def book(client: TestClient, client_id: int, days: int = 3):
+    authorize(client, 0)
+    day = datetime.now() + timedelta(days=days)
+    return client.post(
+        "/appointment",
+        json={
+            "client_id": client_id,
+            "description": "Mowing",
+            "price": 40,
+            "date": int(day.timestamp()),
+        },
+    )
+
+
+def test_booking_queues_notification_sent_by_worker(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    worker: outbox.OutboxWorker,
+    smtp_server,
+):
+    client_id, email, name = sample_client.id, sample_client.email, sample_client.name
+    response = book(client, client_id)
+    assert response.status_code == status.HTTP_201_CREATED
+    # Queued with the appointment, nothing sent on the request path
+    assert smtp_server.messages == []
+    row = session.scalars(select(models.Notification)).one()
+    assert (row.kind, row.recipient) == (outbox.APPOINTMENTS_BOOKED, email)
+    assert row.payload == {"name": name, "dates": [response.json()["date"]]}
+
+    assert worker.drain_once() == {"claimed": 1, "sent": 1, "failed": 0, "deferred": 0}
+    [(recipients, message)] = smtp_server.messages
+    assert recipients == [email]
+    assert message["Subject"] == "Appointment booked"
+    assert response.json()["date"] in message.get_payload()
+    assert worker.drain_once()["claimed"] == 0
+
+
+def test_rejected_conflict_queues_nothing(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    client_id = sample_client.id
+    assert book(client, client_id).status_code == status.HTTP_201_CREATED
+    assert book(client, client_id).status_code == status.HTTP_409_CONFLICT
+    assert len(session.scalars(select(models.Notification)).all()) == 1
+
+
+def test_batch_reuses_connection(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    worker: outbox.OutboxWorker,
+    smtp_server,
+):
+    client_id = sample_client.id
+    for days in range(3, 8):
+        assert book(client, client_id, days).status_code == status.HTTP_201_CREATED
+    assert worker.drain_once()["sent"] == 5
+    assert worker.drain_once()["sent"] == 0
+    assert len(smtp_server.messages) == 5
+    assert smtp_server.connections == 1
+
+
+def test_failed_send_retried_with_backoff(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    worker: outbox.OutboxWorker,
+    smtp_server,
+):
+    client_id, email = sample_client.id, sample_client.email
+    book(client, client_id)
+    smtp_server.reject.add(email)
+
+    assert worker.drain_once() == {"claimed": 1, "sent": 0, "failed": 1, "deferred": 0}
+    row = session.scalars(select(models.Notification)).one()
+    assert row.attempts == 1 and row.sent_at is None
+    assert "550" in row.last_error
+    delay = row.next_attempt_at - row.created_at
+    assert timedelta(seconds=55) < delay < timedelta(seconds=65)
+    # Not due yet
+    assert worker.drain_once()["claimed"] == 0
+
+    smtp_server.reject.clear()
+    session.execute(update(models.Notification).values(next_attempt_at=row.created_at))
+    session.commit()
+    assert worker.drain_once()["sent"] == 1
+    session.expire_all()
+    row = session.scalars(select(models.Notification)).one()
+    assert row.attempts == 2 and row.sent_at is not None
+
+
+def test_gives_up_after_max_attempts(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    worker: outbox.OutboxWorker,
+    smtp_server,
+):
+    client_id, email = sample_client.id, sample_client.email
+    book(client, client_id)
+    smtp_server.reject.add(email)
+    for _ in range(worker.max_attempts):
+        session.execute(
+            update(models.Notification).values(
+                next_attempt_at=models.Notification.created_at
+            )
+        )
+        session.commit()
+        assert worker.drain_once()["failed"] == 1
+    session.execute(
+        update(models.Notification).values(
+            next_attempt_at=models.Notification.created_at
+        )
+    )
+    session.commit()
+    assert worker.drain_once()["claimed"] == 0
+
+
+def test_unrenderable_row_dropped_without_failing_batch(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    worker: outbox.OutboxWorker,
+    smtp_server,
+):
+    client_id = sample_client.id
+    book(client, client_id)
+    session.execute(
+        outbox.notification(outbox.APPOINTMENTS_CANCELLED, "a@example.com", name="A")
+    )
+    session.execute(
+        outbox.notification(outbox.CLIENT_DELETED, "b\n@example.com", name="B")
+    )
+    session.commit()
+
+    assert worker.drain_once() == {"claimed": 3, "sent": 1, "failed": 2, "deferred": 0}
+    assert len(smtp_server.messages) == 1
+    rows = session.scalars(
+        select(models.Notification).where(models.Notification.sent_at.is_(None))
+    ).all()
+    assert {row.recipient for row in rows} == {"a@example.com", "b\n@example.com"}
+    assert all(row.attempts == worker.max_attempts for row in rows)
+    assert all(row.last_error.startswith("Rendering failed") for row in rows)
+    assert worker.drain_once()["claimed"] == 0
+
+
+def test_unreachable_server_defers_rest_of_batch(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    worker: outbox.OutboxWorker,
+):
+    client_id = sample_client.id
+    for days in range(3, 6):
+        book(client, client_id, days)
+    connects = []
+
+    class DownMailer(outbox.Mailer):
+        def connect(self):
+            connects.append(1)
+            raise ConnectionRefusedError("Connection refused")
+
+    worker.mailer = DownMailer("127.0.0.1", 0)
+    assert worker.drain_once() == {
+        "claimed": 3,
+        "sent": 0,
+        "failed": 1,
+        "deferred": 2,
+    }
+    assert len(connects) == 1
+    rows = session.scalars(
+        select(models.Notification).order_by(models.Notification.id)
+    ).all()
+    assert [row.attempts for row in rows] == [1, 0, 0]
+    assert all("refused" in row.last_error for row in rows)
+    assert worker.drain_once()["claimed"] == 0
+
+
+def test_delivered_messages_kept_when_batch_fails(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    worker: outbox.OutboxWorker,
+    smtp_server,
+    monkeypatch,
+):
+    client_id, email = sample_client.id, sample_client.email
+    book(client, client_id, 3)
+    book(client, client_id, 4)
+    send = worker.mailer.send
+    sends = []
+
+    def refuse_second(message):
+        sends.append(message)
+        if len(sends) > 1:
+            raise smtplib.SMTPRecipientsRefused({email: (550, b"No such user")})
+        send(message)
+
+    def broken_retry(row, error):
+        raise RuntimeError("Database went away")
+
+    monkeypatch.setattr(worker.mailer, "send", refuse_second)
+    monkeypatch.setattr(worker, "_retry", broken_retry)
+    with pytest.raises(RuntimeError):
+        worker.drain_once()
+    assert len(smtp_server.messages) == 1
+
+    monkeypatch.undo()
+    session.execute(update(models.Notification).values(next_attempt_at=func.now()))
+    session.commit()
+    assert worker.drain_once()["sent"] == 1
+    assert len(smtp_server.messages) == 2
+
+
+def test_concurrent_workers_skip_locked_rows(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    smtp_server,
+):
+    client_id = sample_client.id
+    for days in range(3, 7):
+        book(client, client_id, days)
+
+    first = outbox.OutboxWorker(
+        engine, outbox.Mailer(*smtp_server.server_address), 2, 3, 60
+    )
+    second = outbox.OutboxWorker(
+        engine, outbox.Mailer(*smtp_server.server_address), 10, 3, 60
+    )
+    claimed = {}
+
+    class HeldMailer(outbox.Mailer):
+        def send(self, message):
+            # The second worker drains while the first is mid-batch
+            if "second" not in claimed:
+                claimed["second"] = second.drain_once()
+            super().send(message)
+
+    first.mailer = HeldMailer(*smtp_server.server_address)
+    claimed["first"] = first.drain_once()
+    assert claimed["first"]["sent"] == 2
+    assert claimed["second"]["sent"] == 2
+    # Every notification went out exactly once
+    bodies = [message.get_payload() for _, message in smtp_server.messages]
+    assert len(bodies) == len(set(bodies)) == 4
+    first.mailer.close()
+    second.mailer.close()
+
+
+def test_client_deletion_and_cancellations_notify(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+):
+    client_id, email = sample_client.id, sample_client.email
+    ids = [book(client, client_id, days).json()["id"] for days in (3, 4, 5)]
+    authorize(client, client_id)
+    assert client.delete(f"/appointment?id={ids[0]}").status_code == 200
+    response = client.delete(f"/appointment/bulk?id={ids[1]}&id={ids[2]}")
+    assert sorted(response.json()) == ids[1:]
+    assert client.delete("/client").status_code == 200
+
+    rows = session.scalars(
+        select(models.Notification).order_by(models.Notification.id)
+    ).all()
+    assert [row.kind for row in rows] == [outbox.APPOINTMENTS_BOOKED] * 3 + [
+        outbox.APPOINTMENTS_CANCELLED,
+        outbox.APPOINTMENTS_CANCELLED,
+        outbox.CLIENT_DELETED,
+    ]
+    assert {row.recipient for row in rows} == {email}
+    assert len(rows[4].payload["dates"]) == 2
@@ -0,0 +1,174 @@
+import asyncio
+from fastapi import status
+from app import models, ratelimit, utils
+from app.ratelimit import Budget, MemoryBuckets, RateLimiter, RedisBuckets
+import pytest
+from .database import client, session, TestClient, TestSessionLocal
+from .test_appointments import authorize
+from .test_clients import sample_client, sample_client_data
+
+
+@pytest.fixture
+def budgets(monkeypatch) -> dict:
+    budgets = {
+        "login": Budget(rate=0.01, burst=2),
+        "read": Budget(rate=0.01, burst=3),
+        "write": Budget(rate=0.01, burst=3),
+    }
+    monkeypatch.setattr(ratelimit.limiter, "budgets", budgets)
+    return budgets
+
+
+def test_login_throttled_before_hashing(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    budgets: dict,
+    monkeypatch,
+):
+    email = sample_client.email
+    verify = utils.verify_async
+    verified = []
+
+    async def counting_verify(*args):
+        verified.append(args)
+        return await verify(*args)
+
+    monkeypatch.setattr(utils, "verify_async", counting_verify)
+    for _ in range(2):
+        response = client.post(
+            "/auth/login", data={"username": email, "password": "wrong"}
+        )
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+    hashed = len(verified)
+
+    response = client.post("/auth/login", data={"username": email, "password": "x"})
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert response.json() == {"detail": "Too many requests"}
+    # A token comes back every 100 seconds at 0.01 per second
+    assert 90 < int(response.headers["Retry-After"]) <= 100
+    assert len(verified) == hashed
+    assert ratelimit.limiter.rejected["login"] == 1
+
+
+def test_login_budget_ignores_spoofed_forwarded_addresses(
+    client: TestClient, session: TestSessionLocal, budgets: dict, monkeypatch
+):
+    # Behind one proxy, which appends the address it saw
+    monkeypatch.setattr(ratelimit.limiter, "proxy_hops", 1)
+
+    def login(forwarded_for: str) -> int:
+        return client.post(
+            "/auth/login",
+            data={"username": "nobody@example.com", "password": "wrong"},
+            headers={"X-Forwarded-For": forwarded_for},
+        ).status_code
+
+    for spoofed in ("10.0.0.1", "10.0.0.2"):
+        assert login(f"{spoofed}, 203.0.113.1") == status.HTTP_403_FORBIDDEN
+    assert login("10.0.0.3, 203.0.113.1") == status.HTTP_429_TOO_MANY_REQUESTS
+    assert login("10.0.0.3, 203.0.113.2") == status.HTTP_403_FORBIDDEN
+
+
+def test_reads_budgeted_per_client(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    budgets: dict,
+):
+    client_id = sample_client.id
+    authorize(client, client_id)
+    for _ in range(3):
+        assert client.get("/client").status_code == status.HTTP_200_OK
+    assert client.get("/client").status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    # Writes have their own budget
+    assert client.delete("/appointment?id=1").status_code == status.HTTP_404_NOT_FOUND
+
+    # Another client, and anonymous requests from the same address, are not
+    # held back by this client's budget
+    authorize(client, client_id + 1)
+    assert client.get("/client").status_code != status.HTTP_429_TOO_MANY_REQUESTS
+    client.headers["Authorization"] = "Bearer not-a-token"
+    assert client.get("/client").status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_memory_buckets_refill(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit, "time", lambda: now[0])
+    buckets = MemoryBuckets(shards=4)
+    budget = Budget(rate=2, burst=2)
+
+    async def run():
+        assert await buckets.take("a", budget) == 0
+        assert await buckets.take("a", budget) == 0
+        assert await buckets.take("a", budget) == pytest.approx(0.5)
+        assert await buckets.take("b", budget) == 0
+        now[0] += 0.5
+        assert await buckets.take("a", budget) == 0
+        now[0] += 10
+        # Never more than the burst
+        for _ in range(2):
+            assert await buckets.take("a", budget) == 0
+        assert await buckets.take("a", budget) > 0
+
+    asyncio.run(run())
+
+
+def test_memory_buckets_bounded():
+    buckets = MemoryBuckets(shards=2, max_keys=10)
+    budget = Budget(rate=1, burst=1)
+
+    async def run():
+        for key in range(100):
+            await buckets.take(str(key), budget)
+
+    asyncio.run(run())
+    assert sum(len(shard) for _, shard in buckets._shards) <= 10
+
+
+class FakeRedis:
+    def __init__(self, wait: str = "0", error: Exception = None):
+        self.wait = wait
+        self.error = error
+        self.calls = []
+
+    async def eval(self, script, numkeys, *keys_and_args):
+        if self.error:
+            raise self.error
+        self.calls.append(keys_and_args)
+        return self.wait
+
+
+def test_redis_buckets():
+    fake = FakeRedis(wait="1.5")
+    limiter = RateLimiter(RedisBuckets(fake), {"read": Budget(1, 5)})
+    scope = {
+        "path": "/client",
+        "method": "GET",
+        "headers": [],
+        "client": ("10.0.0.1", 1234),
+    }
+
+    assert asyncio.run(limiter.check(scope)) == 1.5
+    key, rate, burst, _ = fake.calls[0]
+    assert (key, rate, burst) == ("ratelimit:read:ip:10.0.0.1", 1, 5)
+
+    # A store that is down lets requests through
+    limiter.store = RedisBuckets(FakeRedis(error=ConnectionError()))
+    assert asyncio.run(limiter.check(scope)) == 0
+
+
+def test_rejections_in_metrics(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    budgets: dict,
+):
+    authorize(client, sample_client.id)
+    for _ in range(4):
+        client.get("/client")
+    client.headers.pop("Authorization")
+    assert (
+        'lawncare_rate_limited_total{budget="read"} 1'
+        in client.get("/metrics").text.splitlines()
+    )
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+from fastapi import status
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from app import database, models
+from app.config import settings
+from app.database import Base, ReplicaSet, ThreadpoolSession
+import pytest
+from .database import SQLALCHEMY_DATABASE_URL, client, session, engine
+from .database import TestSessionLocal, TestClient
+from .test_appointments import authorize
+from .test_clients import sample_client, sample_client_data
+
+# A second database standing in for a replica; it is never written to by
+# the API, so rows only it holds show which one served a read
+REPLICA_DATABASE_URL = f"{SQLALCHEMY_DATABASE_URL}_replica"
+
+
+@pytest.fixture
+def replica(session: TestSessionLocal, monkeypatch) -> TestSessionLocal:
+    name = f"{settings.database_name}_test_replica"
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if not conn.scalar(
+            text("SELECT 1 FROM pg_database WHERE datname = :name"), {"name": name}
+        ):
+            conn.execute(text(f'CREATE DATABASE "{name}"'))
+
+    replica_engine = create_engine(REPLICA_DATABASE_URL, poolclass=NullPool)
+    Base.metadata.drop_all(bind=replica_engine)
+    Base.metadata.create_all(bind=replica_engine)
+    ReplicaSessionLocal = sessionmaker(bind=replica_engine)
+    if settings.database_async:
+        async_engine = create_async_engine(
+            REPLICA_DATABASE_URL.replace("postgresql", "postgresql+asyncpg"),
+            poolclass=NullPool,
+        )
+        factory = sessionmaker(bind=async_engine, class_=AsyncSession)
+    else:
+        factory = lambda: ThreadpoolSession(ReplicaSessionLocal())
+    monkeypatch.setattr(database, "replicas", ReplicaSet([factory], 60))
+
+    db = ReplicaSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+        replica_engine.dispose()
+
+
+def test_reads_use_replica_until_written(
+    client: TestClient,
+    session: TestSessionLocal,
+    replica: TestSessionLocal,
+    sample_client: models.Client,
+):
+    client_id = sample_client.id
+    primary_name = sample_client.name
+    replica.add(
+        models.Client(
+            id=client_id,
+            name="Replica",
+            email="replica@example.com",
+            phone_number="555-555-5555",
+            address="1 Replica Way",
+            password="unused",
+        )
+    )
+    replica.commit()
+
+    authorize(client, client_id)
+    assert client.get("/client").json()["name"] == "Replica"
+
+    authorize(client, 0)
+    assert client.get("/client", params={"id": client_id}).json()["name"] == "Replica"
+    response = client.post(
+        "/appointment",
+        json={
+            "client_id": client_id,
+            "description": "Mowing",
+            "price": 45,
+            "date": int((datetime.now() + timedelta(days=3)).timestamp()),
+        },
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+
+    # Reads of the written client stick to the primary
+    assert (
+        client.get("/client", params={"id": client_id}).json()["name"] == primary_name
+    )
+    authorize(client, client_id)
+    assert client.get("/client").json()["name"] == primary_name
+    assert len(client.get("/appointment").json()) == 1
@@ -0,0 +1,119 @@
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import status
+from app import intake, models
+from app.config import settings
+from app.database import ThreadpoolSession
+import pytest
+from .database import client, session, TestAsyncSessionLocal, TestSessionLocal
+from .database import TestClient
+from .test_appointments import authorize
+from .test_clients import sample_client, sample_client_data
+
+
+@pytest.fixture
+def request_buffer(session: TestSessionLocal, monkeypatch) -> intake.RequestBuffer:
+    @asynccontextmanager
+    async def session_scope():
+        if settings.database_async:
+            db = TestAsyncSessionLocal()
+        else:
+            db = ThreadpoolSession(session)
+        try:
+            yield db
+        finally:
+            await db.close()
+
+    monkeypatch.setattr(intake.buffer, "session_scope", session_scope)
+    monkeypatch.setattr(intake.buffer, "pending", [])
+    return intake.buffer
+
+
+def test_requests_written_in_batches(
+    client: TestClient,
+    session: TestSessionLocal,
+    sample_client: models.Client,
+    request_buffer: intake.RequestBuffer,
+    monkeypatch,
+):
+    client_id, email = sample_client.id, sample_client.email
+    for sender in (email, "first@example.com", "second@example.com"):
+        response = client.post(
+            "/request", json={"email": sender, "description": "Weekly mowing quote"}
+        )
+        assert response.status_code == status.HTTP_202_ACCEPTED
+    assert not session.query(models.Request).count()
+
+    monkeypatch.setattr(request_buffer, "max_rows", 2)
+    asyncio.run(request_buffer.flush())
+    assert not request_buffer.pending
+    requests = session.query(models.Request).order_by(models.Request.id).all()
+    assert [(r.email, r.client_id) for r in requests] == [
+        (email, client_id),
+        ("first@example.com", None),
+        ("second@example.com", None),
+    ]
+
+    authorize(client, 0)
+    response = client.get("/request", params={"limit": 2})
+    assert response.status_code == status.HTTP_200_OK
+    assert [row["email"] for row in response.json()] == [email, "first@example.com"]
+    response = client.get(
+        "/request", params={"cursor": response.headers["X-Next-Cursor"]}
+    )
+    assert [row["email"] for row in response.json()] == ["second@example.com"]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_stop_waits_for_running_flush(
+    session: TestSessionLocal, request_buffer: intake.RequestBuffer, monkeypatch
+):
+    session_scope = request_buffer.session_scope
+    monkeypatch.setattr(request_buffer, "max_rows", 2)
+    monkeypatch.setattr(request_buffer, "flush_seconds", 60)
+
+    async def run():
+        writing, release = asyncio.Event(), asyncio.Event()
+
+        @asynccontextmanager
+        async def slow_session_scope():
+            writing.set()
+            await release.wait()
+            async with session_scope() as db:
+                yield db
+
+        monkeypatch.setattr(request_buffer, "session_scope", slow_session_scope)
+        request_buffer.start()
+        for sender in ("first@example.com", "second@example.com"):
+            request_buffer.submit(sender, "Quote")
+        await writing.wait()
+        request_buffer.submit("third@example.com", "Quote")
+
+        stopping = asyncio.create_task(request_buffer.stop())
+        await asyncio.sleep(0.05)
+        assert not stopping.done()
+        release.set()
+        await stopping
+        assert request_buffer._task is None
+
+    asyncio.run(run())
+    assert not request_buffer.pending
+    assert session.query(models.Request).count() == 3
+
+
+def test_request_submit_sheds_load(
+    client: TestClient, request_buffer: intake.RequestBuffer, monkeypatch
+):
+    monkeypatch.setattr(request_buffer, "max_pending", 0)
+    response = client.post(
+        "/request", json={"email": "a@example.com", "description": "Quote"}
+    )
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"]
+
+
+def test_requests_listing_requires_admin(
+    client: TestClient, session: TestSessionLocal, sample_client: models.Client
+):
+    authorize(client, sample_client.id)
+    assert client.get("/request").status_code == status.HTTP_403_FORBIDDEN
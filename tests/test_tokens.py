@@ -0,0 +1,153 @@
+import asyncio
+from time import time
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from fastapi import HTTPException
+from jose import jwt
+from app import oauth2, tokens
+from app.tokens import Keyring, NativeVerifier, JoseVerifier, TokenError
+import pytest
+from .database import client, session, TestClient
+
+
+def private_pem(key) -> str:
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+
+
+def public_pem(key) -> str:
+    return (
+        key.public_key()
+        .public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+        .decode()
+    )
+
+
+KEYS = {
+    "HS256": lambda: "secret",
+    "ES256": lambda: ec.generate_private_key(ec.SECP256R1()),
+    "EdDSA": ed25519.Ed25519PrivateKey.generate,
+    "RS256": lambda: rsa.generate_private_key(65537, 2048),
+}
+
+
+def keyring(algorithm: str, kid: str = "", verification_keys: dict = None):
+    key = KEYS[algorithm]()
+    material = key if isinstance(key, str) else private_pem(key)
+    return Keyring(algorithm, material, kid, verification_keys), key
+
+
+def claims(**overrides) -> dict:
+    return {"client_id": "7", "host": "h", "exp": int(time()) + 60, **overrides}
+
+
+@pytest.mark.parametrize("algorithm", KEYS)
+def test_sign_and_verify(algorithm: str):
+    ring, _ = keyring(algorithm)
+    verifier = NativeVerifier(ring)
+    verified = verifier.verify(ring.sign(claims(testing="True")))
+    assert (verified.client_id, verified.host, verified.testing) == ("7", "h", "True")
+    assert verified.host_sig is None
+    with pytest.raises(AttributeError):
+        verified.extra = 1
+
+    token = ring.sign(claims())
+    header, payload, signature = token.split(".")
+    forged = tokens.b64encode(b'{"client_id":"0","host":"h"}').decode()
+    for bad in (
+        f"{header}.{forged}.{signature}",
+        f"{header}.{payload}.{signature[:-4]}AAAA",
+        f"{header}.{payload}",
+        "not a token",
+        ring.sign(claims(exp=int(time()) - 1)),
+        ring.sign({"host": "h"}),
+    ):
+        with pytest.raises(TokenError):
+            verifier.verify(bad)
+
+
+def test_public_key_only_verifies():
+    _, key = keyring("EdDSA")
+    signer = Keyring("EdDSA", private_pem(key))
+    verifier = NativeVerifier(Keyring("EdDSA", public_pem(key)))
+    assert verifier.verify(signer.sign(claims())).client_id == "7"
+    with pytest.raises(TokenError):
+        verifier.keyring.sign(claims())
+
+
+def test_algorithm_confusion_rejected():
+    ring, key = keyring("ES256")
+    # HS256 "signed" with the public key, as if it were the secret
+    token = Keyring("HS256", public_pem(key)).sign(claims())
+    with pytest.raises(TokenError):
+        NativeVerifier(ring).verify(token)
+    none = tokens.b64encode(b'{"alg":"none"}').decode()
+    with pytest.raises(TokenError):
+        NativeVerifier(ring).verify(f"{none}.{ring.sign(claims()).split('.')[1]}.")
+
+
+def test_key_rotation():
+    old, _ = keyring("HS256", kid="2022-08")
+    old_token = old.sign(claims())
+    assert jwt.get_unverified_header(old_token)["kid"] == "2022-08"
+
+    new = Keyring("HS256", "new secret", "2022-09", {"2022-08": "secret"})
+    verifier = NativeVerifier(new)
+    assert verifier.verify(old_token).client_id == "7"
+    assert verifier.verify(new.sign(claims())).client_id == "7"
+    # Once the old key is retired, its tokens are refused
+    retired = NativeVerifier(Keyring("HS256", "new secret", "2022-09"))
+    with pytest.raises(TokenError):
+        retired.verify(old_token)
+
+
+@pytest.mark.parametrize("algorithm", ("HS256", "ES256"))
+def test_jose_backend_interoperates(algorithm: str):
+    ring, key = keyring(algorithm, kid="k1")
+    verifier = JoseVerifier(ring)
+    assert verifier.verify(ring.sign(claims())).client_id == "7"
+    material = key if isinstance(key, str) else private_pem(key)
+    token = jwt.encode(claims(), material, algorithm=algorithm, headers={"kid": "k1"})
+    assert NativeVerifier(ring).verify(token).client_id == "7"
+    with pytest.raises(TokenError):
+        verifier.verify(ring.sign(claims(exp=int(time()) - 1)))
+
+
+def test_verified_claims_cached(monkeypatch):
+    ring, _ = keyring("EdDSA")
+    monkeypatch.setattr(tokens, "verifier", NativeVerifier(ring))
+    monkeypatch.setattr(oauth2, "claims_cache", oauth2.TTLCache(16))
+    token = ring.sign(claims())
+    first = oauth2.decode_access_token(token)
+    assert asyncio.run(oauth2.verify_access_token(token)) is first
+    assert oauth2.claims_cache.stats()["hits"] == 1
+    # Shared between requests, so it cannot be changed
+    with pytest.raises(AttributeError):
+        first.client_id = "0"
+
+    with pytest.raises(HTTPException):
+        oauth2.decode_access_token(token[:-4] + "AAAA")
+    # Entries never outlive the token
+    oauth2.claims_cache.clear()
+    monkeypatch.setattr(tokens, "time", lambda: 0)
+    oauth2.decode_access_token(ring.sign(claims(exp=int(time()) - 1)))
+    assert len(oauth2.claims_cache) == 0
+
+
+def test_jwks_endpoint(client: TestClient, monkeypatch):
+    assert client.get("/auth/keys").json() == {"keys": []}
+
+    ring, key = keyring("EdDSA", kid="k1")
+    monkeypatch.setattr(tokens, "keyring", ring)
+    [jwk] = client.get("/auth/keys").json()["keys"]
+    assert jwk["kid"] == "k1" and jwk["alg"] == "EdDSA" and jwk["crv"] == "Ed25519"
+    raw = key.public_key().public_bytes(
+        serialization.Encoding.Raw, serialization.PublicFormat.Raw
+    )
+    assert tokens.b64decode(jwk["x"].encode()) == raw